@@ -0,0 +1,108 @@
+#folder name extraction benchmark, run it with: python benchmarks/bench_caption.py
+#compares fastfox.simplify_caption with the original per-call nltk.pos_tag implementation on a reference corpus of
+#BLIP captions and model answers, checks both give the same folder names and prints their throughput.
+import os
+import re
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fastfox
+
+#captions and topic answers like the ones organize gets back from BLIP and llama3.
+REFERENCE_CORPUS = [
+    "a dog sitting on a couch next to a cat",
+    "a man riding a wave on top of a surfboard",
+    "there is a plate of food with broccoli and rice",
+    "arafed view of a city skyline at night with lights",
+    "a group of people standing around a table with laptops",
+    "a close up of a person holding a cell phone",
+    "a red car parked in front of a building",
+    "a bunch of bananas sitting on top of a wooden table",
+    "a screenshot of a spreadsheet with numbers and charts",
+    "a black and white photo of a train station",
+    "two giraffes standing next to each other in a field",
+    "a bowl of soup with a spoon on a table",
+    "a woman in a wedding dress holding flowers",
+    "a page of text with a diagram of a circuit",
+    "an aerial view of a beach with umbrellas",
+    "Finance",
+    "Topic: Finance",
+    "The topic is Marketing.",
+    "Based on the column names, the topic is Sales.",
+    "Summary: this document describes the quarterly revenue of the company. Topic: Revenue",
+    "Invoices",
+    "The single-word topic for this text is Healthcare.",
+    "Education",
+    "This CSV file contains employee records. Topic: Employees",
+    "Human Resources",
+    "The text is a research paper about neural networks. Topic: AI",
+    "Logistics",
+    "Inventory management",
+    "Topic: Real Estate",
+    "The document is a lease agreement. Single-word topic: Lease",
+    "",
+    "!!!",
+]
+
+#the original implementation: nltk.pos_tag reloads the tagger on every call and nouns are ranked with tokens.index.
+def baseline_simplify(caption: str) -> str:
+    from nltk import pos_tag
+    word_tokenize = fastfox.load_nltk()
+    tokens = word_tokenize(caption)
+    tagged_words = pos_tag(tokens)
+
+    nouns = [word for word, pos in tagged_words if pos in ('NN', 'NNS', 'NNP', 'NNPS')]
+
+    if not nouns:
+        return fastfox.sanitize_folder_name(tokens[0]) if tokens else "Untitled"
+
+    ranked_nouns = sorted(nouns, key=lambda word: (len(word), tokens.index(word)), reverse=True)
+
+    most_meaningful_word = ranked_nouns[0]
+
+    simplified_word = re.sub(r'[^a-zA-Z0-9]', '', most_meaningful_word)
+    if simplified_word.endswith('s') and len(simplified_word) > 3:
+        simplified_word = simplified_word[:-1]
+
+    return fastfox.sanitize_folder_name(simplified_word)
+
+def throughput(function, captions, rounds: int, clear_cache: bool) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        if clear_cache:
+            fastfox.simplify_caption.cache_clear()
+        for caption in captions:
+            function(caption)
+    return rounds * len(captions) / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the folder name extractor with the original nltk path.")
+    parser.add_argument('--rounds', type=int, default=3, help="passes over the reference corpus per measurement")
+    args = parser.parse_args()
+
+    fastfox.ensure_nltk_data()
+
+    mismatches = [
+        (caption, expected, actual)
+        for caption in REFERENCE_CORPUS
+        for expected, actual in [(baseline_simplify(caption), fastfox.simplify_caption(caption))]
+        if expected != actual
+    ]
+    for caption, expected, actual in mismatches:
+        print(f"MISMATCH {caption!r}: nltk path gives {expected!r}, fastfox gives {actual!r}")
+
+    baseline = throughput(baseline_simplify, REFERENCE_CORPUS, args.rounds, clear_cache=False)
+    uncached = throughput(fastfox.simplify_caption, REFERENCE_CORPUS, args.rounds, clear_cache=True)
+    cached = throughput(fastfox.simplify_caption, REFERENCE_CORPUS, args.rounds, clear_cache=False)
+
+    print(f"{'nltk.pos_tag per call':<28}{baseline:>12.0f} captions/s")
+    print(f"{'warm tagger':<28}{uncached:>12.0f} captions/s ({uncached / baseline:.0f}x)")
+    print(f"{'warm tagger + memo':<28}{cached:>12.0f} captions/s ({cached / baseline:.0f}x)")
+    print(f"{len(REFERENCE_CORPUS) - len(mismatches)}/{len(REFERENCE_CORPUS)} captions give the same folder name")
+
+    sys.exit(1 if mismatches else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+#organize throughput benchmark, run it with: python benchmarks/bench_organize.py --files=100 --sizes=small,medium
+#generates a synthetic corpus for every size, organizes it against the local groq/hf mock server in a fresh interpreter
+#and reports files/sec, per-stage latency (from fastfox's tracer) and peak RSS, plus the startup time of every subcommand.
+#use --json=results.json to save the numbers and compare them across commits.
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+from contextlib import redirect_stdout
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from make_corpus import SIZES, make_corpus
+from mock_servers import add_settings_arguments, settings_from_args, start_mock_server
+
+#peak RSS of this process, or of its largest child process (the extraction workers) with children.
+def peak_rss_mb(children: bool = False):
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+#runs in the child interpreter: organizes the corpus once and prints the measurements as json.
+def run_child(args):
+    sys.path.insert(0, ROOT)
+    import fastfox
+    from groq import Groq
+
+    fastfox.HF_API_URL = args.base_url + "/models/"
+    fastfox.JOBS_DIR = os.path.join(args.work_dir, "jobs")
+    fastfox.TOPIC_CACHE = fastfox.TopicCache(os.path.join(args.work_dir, "cache.db"))
+    fastfox.TOPIC_CACHE.enabled = args.cache
+    fastfox.QUOTA = fastfox.QuotaLedger(os.path.join(args.work_dir, "quota.db"), fastfox.QUOTAS)
+    fastfox.QUOTA.enabled = args.rate_limits
+    if args.backend != 'remote':
+        fastfox.CLASSIFIER = fastfox.select_backend(args.backend, fastfox.LOCAL_CONFIDENCE)
+
+    groq_client = Groq(api_key="benchmark", base_url=args.base_url)
+    hf_headers = {"Authorization": "Bearer benchmark"}
+    fastfox.ensure_nltk_data()
+
+    files = len(os.listdir(args.corpus))
+    output = io.StringIO()
+    with redirect_stdout(output):
+        start = time.perf_counter()
+        fastfox.organize_folder(args.corpus, groq_client, hf_headers, workers=args.workers, batch_size=args.batch, extract_workers=args.extract_workers)
+        elapsed = time.perf_counter() - start
+    errors = [line for line in output.getvalue().splitlines() if line.startswith("Error")]
+
+    other = os.path.join(args.corpus, 'other_files')
+    leftover = [name for name in os.listdir(args.corpus) if os.path.isfile(os.path.join(args.corpus, name))]
+    print(json.dumps({
+        'files': files,
+        'seconds': elapsed,
+        'files_per_sec': files / elapsed if elapsed else 0.0,
+        'not_moved': len(leftover),
+        'errors': errors[:20],
+        'other_files': len(os.listdir(other)) if os.path.isdir(other) else 0,
+        'peak_rss_mb': peak_rss_mb(),
+        'extract_rss_mb': peak_rss_mb(children=True) if args.extract_workers > 0 else None,
+        'hf_retries': fastfox.HF_STATS.retries,
+        'stages': {
+            name: {
+                'calls': len(durations),
+                'total_s': sum(durations),
+                'p50_ms': fastfox.TRACER.percentile(sorted(durations), 0.5) * 1000,
+                'p95_ms': fastfox.TRACER.percentile(sorted(durations), 0.95) * 1000,
+            }
+            for name, durations in sorted(fastfox.TRACER.stages.items())
+        },
+        'tokens': {stage + '.' + key: value for (stage, key), value in fastfox.TRACER.counters.items()}
+    }))
+
+def organize_once(args, size: str, base_url: str) -> dict:
+    work_dir = tempfile.mkdtemp(prefix=f"fastfox-bench-{size}-")
+    try:
+        corpus = os.path.join(work_dir, "corpus")
+        make_corpus(corpus, args.files, size, args.seed)
+        command = [
+            sys.executable, os.path.abspath(__file__), '--child', '--corpus', corpus, '--work-dir', work_dir,
+            '--base-url', base_url, '--workers', str(args.workers), '--batch', str(args.batch), '--backend', args.backend,
+            '--extract-workers', str(args.extract_workers)
+        ]
+        if args.cache:
+            command.append('--cache')
+        if args.rate_limits:
+            command.append('--rate-limits')
+        result = subprocess.run(command, cwd=ROOT, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"organize benchmark failed for {size}:\n{result.stderr}")
+        return json.loads(result.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def startup_times(runs: int) -> dict:
+    from bench_startup import run_once
+    times = {}
+    for command_type in ['forget', 'command', 'codeit', 'organize']:
+        totals = [run_once(command_type)['total'] for _ in range(runs)]
+        times[command_type] = statistics.median(totals) * 1000
+    return times
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def print_report(size: str, result: dict):
+    rss = f"{result['peak_rss_mb']:.1f} MB" if result['peak_rss_mb'] is not None else "n/a"
+    if result.get('extract_rss_mb'):
+        rss += f" (extraction workers {result['extract_rss_mb']:.1f} MB each)"
+    print(f"\n{size}: {result['files']} files in {result['seconds']:.2f}s, {result['files_per_sec']:.1f} files/sec, peak RSS {rss}")
+    if result['not_moved']:
+        print(f"  {result['not_moved']} files were not moved")
+    for error in result['errors'][:3]:
+        print(f"  {error[:150]}")
+    print(f"  {'stage':<18}{'calls':>8}{'total s':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for label, stage in result['stages'].items():
+        print(f"  {label:<18}{stage['calls']:>8}{stage['total_s']:>10.2f}{stage['p50_ms']:>10.1f}{stage['p95_ms']:>10.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark fastfox organize against local mock Groq and Hugging Face servers.")
+    parser.add_argument('--files', type=int, default=60, help="files in every corpus")
+    parser.add_argument('--sizes', default='small,medium', help=f"comma separated corpus sizes out of {', '.join(SIZES)}")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--batch', type=int, default=8)
+    parser.add_argument('--extract-workers', type=int, default=None, help="extraction processes, 0 reads on threads (fastfox's default otherwise)")
+    parser.add_argument('--backend', choices=['auto', 'local', 'remote'], default='remote')
+    parser.add_argument('--cache', action='store_true', help="keep the topic cache on (it's off so every run is cold)")
+    parser.add_argument('--rate-limits', action='store_true', help="keep the free tier quotas (they're lifted by default)")
+    parser.add_argument('--startup-runs', type=int, default=3, help="fresh interpreters per subcommand for the startup times, 0 skips them")
+    parser.add_argument('--json', help="also write the results to this file")
+    add_settings_arguments(parser)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--corpus', help=argparse.SUPPRESS)
+    parser.add_argument('--work-dir', help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.extract_workers is None:
+        sys.path.insert(0, ROOT)
+        from fastfox import EXTRACT_WORKERS
+        args.extract_workers = EXTRACT_WORKERS
+
+    if args.child:
+        run_child(args)
+        return
+
+    server, base_url = start_mock_server(settings_from_args(args))
+    results = {'revision': git_revision(), 'python': sys.version.split()[0], 'organize': {}}
+    try:
+        for size in [size.strip() for size in args.sizes.split(',') if size.strip()]:
+            results['organize'][size] = organize_once(args, size, base_url)
+            print_report(size, results['organize'][size])
+    finally:
+        server.shutdown()
+    results['mock_requests'] = server.settings.counts
+
+    if args.startup_runs > 0:
+        results['startup_ms'] = startup_times(args.startup_runs)
+        print(f"\n{'subcommand':<12}{'startup ms':>12}")
+        for command_type, milliseconds in results['startup_ms'].items():
+            print(f"{command_type:<12}{milliseconds:>12.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+if __name__ == "__main__":
+    main()
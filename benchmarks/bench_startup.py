@@ -0,0 +1,59 @@
+#startup benchmark for fastfox, run it with: python benchmarks/bench_startup.py
+#it times `import fastfox` plus the modules each subcommand loads, each in a fresh interpreter,
+#and fails when importing fastfox starts pulling in heavy modules again (that's what makes `forget` and `command` slow).
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#modules that must never be imported just by loading fastfox.py, they're only loaded by the subcommands that use them.
+HEAVY_MODULES = ['groq', 'nltk', 'PyPDF2', 'openpyxl', 'xlrd', 'olefile', 'docx', 'PIL', 'requests', 'pandas', 'numpy', 'win32com', 'pythoncom']
+
+#runs inside the child interpreter, prints the timings and the heavy modules that got imported as json.
+CHILD_SCRIPT = """
+import sys, time, json
+start = time.perf_counter()
+import fastfox
+imported = time.perf_counter()
+fastfox.preload_modules(sys.argv[1])
+loaded = time.perf_counter()
+heavy = sorted(name for name in json.loads(sys.argv[2]) if name in sys.modules)
+print(json.dumps({'import': imported - start, 'total': loaded - start, 'heavy': heavy}))
+"""
+
+def run_once(command_type: str) -> dict:
+    result = subprocess.run(
+        [sys.executable, '-c', CHILD_SCRIPT, command_type, json.dumps(HEAVY_MODULES)],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure fastfox startup time per subcommand.")
+    parser.add_argument('--runs', type=int, default=5, help="fresh interpreters started per subcommand")
+    parser.add_argument('--max-import-ms', type=float, default=150.0, help="fail when `import fastfox` alone takes longer than this")
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'subcommand':<12}{'import ms':>12}{'total ms':>12}")
+    for command_type in ['forget', 'command', 'codeit', 'organize']:
+        runs = [run_once(command_type) for _ in range(args.runs)]
+        import_ms = statistics.median(run['import'] for run in runs) * 1000
+        total_ms = statistics.median(run['total'] for run in runs) * 1000
+        print(f"{command_type:<12}{import_ms:>12.1f}{total_ms:>12.1f}")
+
+        if runs[0]['heavy'] and command_type == 'forget':
+            print(f"  FAIL: importing fastfox loads {', '.join(runs[0]['heavy'])}")
+            failed = True
+        if import_ms > args.max_import_ms:
+            print(f"  FAIL: import took {import_ms:.1f} ms, budget is {args.max_import_ms:.1f} ms")
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+#checks fastfox's word 97-2003 reader against a document saved by word itself, run it with: python benchmarks/check_doc_reader.py
+#the file has a language id in its fib and its piece table in the 1Table stream, so reading the fib flags from the wrong
+#offset or picking the wrong table stream shows up here. exits with 1 when one of the checks fails.
+import os
+import sys
+import struct
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+
+import olefile
+import fastfox
+
+WORD97_DOC = os.path.join(BENCH_DIR, "data", "word97.doc")
+WORD97_TEXT = "Test OLE file, saved as Word 97-2003 Document.\n"
+
+def main():
+    failures = []
+    start = time.monotonic()
+
+    def check(name: str, passed: bool, detail):
+        print(f"{'ok  ' if passed else 'FAIL'} {name}: {detail}")
+        if not passed:
+            failures.append(name)
+
+    with olefile.OleFileIO(WORD97_DOC) as ole:
+        word_document = ole.openstream('WordDocument').read()
+        streams = ['/'.join(path) for path in ole.listdir()]
+    lid, flags = struct.unpack_from('<H', word_document, 6)[0], struct.unpack_from('<H', word_document, 0x0A)[0]
+    check("the sample is a real word 97 file", lid == 0x0409 and flags & 0x0200 and '1Table' in streams and '0Table' not in streams,
+          f"lid {lid:#06x}, flags {flags:#06x}, streams {streams}")
+
+    try:
+        text = fastfox.read_legacy_doc_text(WORD97_DOC)
+    except Exception as e:
+        text = e
+    check("the main text is read from the piece table", text == WORD97_TEXT, repr(text))
+
+    try:
+        excerpt = fastfox.extract_doc_text(WORD97_DOC)
+    except Exception as e:
+        excerpt = e
+    check("organize's extractor reads it without word", excerpt == WORD97_TEXT, repr(excerpt))
+
+    try:
+        text = fastfox.read_legacy_doc_text(WORD97_DOC, limit=8)
+    except Exception as e:
+        text = e
+    check("only the first limit characters are decoded", text == WORD97_TEXT[:8], repr(text))
+    print(f"{len(failures)} checks failed" if failures else f"All checks passed in {time.monotonic() - start:.2f}s")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
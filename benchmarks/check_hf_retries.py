@@ -0,0 +1,83 @@
+#checks fastfox's hugging face retry path against the mock server, run it with: python benchmarks/check_hf_retries.py
+#a cold model (503 with estimated_time), a 429 with Retry-After and a dropped connection are each retried the configured
+#number of times, with the delay the answer asked for, and the last failure is handed back to the caller.
+#exits with 1 when one of the checks fails.
+import os
+import sys
+import time
+import socket
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, ROOT)
+
+import fastfox
+from mock_servers import MockSettings, start_mock_server
+
+MAX_RETRIES = 2
+
+#calls the captioner once and returns what it answered (or raised), the delays it waited and the call stats.
+def caption_once(base_url: str):
+    fastfox.HF_API_URL = base_url + "/models/"
+    fastfox.HF_STATS = fastfox.CallStats()
+    delays = []
+    retry_delay = fastfox.retry_delay
+
+    def recorded_delay(response, attempt):
+        delays.append(retry_delay(response, attempt))
+        return delays[-1]
+
+    fastfox.retry_delay = recorded_delay
+    try:
+        answer = fastfox.query_huggingface_api(None, fastfox.CAPTION_MODEL, {"Authorization": "Bearer check"}, data=b"jpeg")
+    except Exception as e:
+        answer = e
+    finally:
+        fastfox.retry_delay = retry_delay
+    return answer, delays, fastfox.HF_STATS
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+def main():
+    os.environ['FASTFOX_HF_MAX_RETRIES'] = str(MAX_RETRIES)
+    os.environ['FASTFOX_HF_BACKOFF_BASE'] = "0.05"
+    os.environ['FASTFOX_HF_CONNECT_TIMEOUT'] = "1"
+    fastfox.QUOTA.enabled = False
+    failures = []
+    start = time.monotonic()
+
+    def check(name: str, passed: bool, detail):
+        print(f"{'ok  ' if passed else 'FAIL'} {name}: {detail}")
+        if not passed:
+            failures.append(name)
+
+    server, base_url = start_mock_server(MockSettings(loading_rate=1.0, estimated_time=0.2))
+    answer, delays, stats = caption_once(base_url)
+    server.shutdown()
+    check("model loading is retried", stats.retries == MAX_RETRIES and server.settings.counts['loading'] == MAX_RETRIES + 1,
+          f"{stats.retries} retries, {server.settings.counts['loading']} requests")
+    check("estimated_time is waited for", len(delays) == MAX_RETRIES and all(0.2 <= delay <= 0.24 for delay in delays),
+          [round(delay, 3) for delay in delays])
+    check("the last 503 answer is returned", isinstance(answer, dict) and 'estimated_time' in answer and stats.failures == 1, answer)
+
+    server, base_url = start_mock_server(MockSettings(rate_limit_rate=1.0, retry_after=0.1))
+    answer, delays, stats = caption_once(base_url)
+    server.shutdown()
+    check("429 is retried", stats.retries == MAX_RETRIES and server.settings.counts['rate_limited'] == MAX_RETRIES + 1,
+          f"{stats.retries} retries")
+    check("Retry-After is waited for", delays == [0.1] * MAX_RETRIES, delays)
+
+    answer, delays, stats = caption_once(f"http://127.0.0.1:{free_port()}")
+    check("a refused connection is retried and then raised", type(answer).__name__ == 'ConnectionError' and stats.retries == MAX_RETRIES
+          and stats.failures == 1, f"{type(answer).__name__} after {stats.retries} retries")
+    check("backoff stays under its cap", all(delay <= 0.05 * 2 ** attempt for attempt, delay in enumerate(delays)),
+          [round(delay, 3) for delay in delays])
+    print(f"{len(failures)} checks failed" if failures else f"All checks passed in {time.monotonic() - start:.2f}s")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#synthetic corpus for the organize benchmark, run it on its own with: python benchmarks/make_corpus.py <folder> --files=100 --size=medium
+#writes a mix of pdfs, xlsx, csv, docx, images and other files filled with random words, the same seed gives the same corpus.
+import os
+import csv
+import random
+import argparse
+
+WORDS = ("invoice revenue quarter budget patient clinic student course shipment warehouse contract lease "
+         "campaign customer product market research experiment network model travel flight hotel report "
+         "salary employee inventory supplier order payment account balance forecast schedule").split()
+
+#pages per pdf, rows per spreadsheet or csv, paragraphs per docx and image width for every corpus size.
+SIZES = {
+    'small': {'pages': 1, 'rows': 20, 'paragraphs': 5, 'image': 256},
+    'medium': {'pages': 10, 'rows': 1000, 'paragraphs': 50, 'image': 1024},
+    'large': {'pages': 50, 'rows': 20000, 'paragraphs': 400, 'image': 3000},
+}
+
+#share of each file type in the corpus.
+MIX = [('pdf', 3), ('xlsx', 2), ('csv', 2), ('docx', 2), ('png', 1), ('jpg', 1), ('txt', 1)]
+
+def sentence(rng: random.Random, words: int = 12) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+#writes a plain pdf with one line of text per page, no pdf library needed.
+def write_pdf(path: str, rng: random.Random, pages: int):
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>"]
+    kids = " ".join(f"{3 + 2 * i} 0 R" for i in range(pages))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {pages} >>".encode())
+    font_id = 3 + 2 * pages
+    for i in range(pages):
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {4 + 2 * i} 0 R >>".encode())
+        lines = " T* ".join(f"({sentence(rng)}) Tj" for _ in range(20))
+        stream = f"BT /F1 11 Tf 14 TL 72 720 Td {lines} ET".encode()
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    output = b"%PDF-1.4\n"
+    offsets = []
+    for number, content in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n".encode() + content + b"\nendobj\n"
+    xref = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    output += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, 'wb') as f:
+        f.write(output)
+
+def table_rows(rng: random.Random, rows: int):
+    headers = rng.sample(WORDS, 6)
+    yield headers
+    for _ in range(rows):
+        yield [rng.choice(WORDS) if i % 2 else rng.randint(0, 100000) for i in range(len(headers))]
+
+def write_xlsx(path: str, rng: random.Random, rows: int):
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    for row in table_rows(rng, rows):
+        sheet.append(row)
+    workbook.save(path)
+
+def write_csv(path: str, rng: random.Random, rows: int):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        csv.writer(f).writerows(table_rows(rng, rows))
+
+def write_docx(path: str, rng: random.Random, paragraphs: int):
+    from docx import Document
+    document = Document()
+    for _ in range(paragraphs):
+        document.add_paragraph(" ".join(sentence(rng) for _ in range(4)))
+    document.save(path)
+
+#noise images, every one is different so the perceptual hash never lets organize skip a caption request.
+def write_image(path: str, rng: random.Random, width: int):
+    from PIL import Image
+    height = width * 3 // 4
+    image = Image.frombytes('RGB', (64, 48), rng.randbytes(64 * 48 * 3)).resize((width, height))
+    image.save(path)
+
+def write_other(path: str, rng: random.Random):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(sentence(rng, 50))
+
+#fills folder with count files of the given size and returns how many files of each type were written.
+def make_corpus(folder: str, count: int, size: str = 'small', seed: int = 0) -> dict:
+    settings = SIZES[size]
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    kinds = [kind for kind, weight in MIX for _ in range(weight)]
+    written = {}
+    for i in range(count):
+        kind = kinds[i % len(kinds)]
+        path = os.path.join(folder, f"file_{i:05d}.{kind}")
+        if kind == 'pdf':
+            write_pdf(path, rng, settings['pages'])
+        elif kind == 'xlsx':
+            write_xlsx(path, rng, settings['rows'])
+        elif kind == 'csv':
+            write_csv(path, rng, settings['rows'])
+        elif kind == 'docx':
+            write_docx(path, rng, settings['paragraphs'])
+        elif kind in ('png', 'jpg'):
+            write_image(path, rng, settings['image'])
+        else:
+            write_other(path, rng)
+        written[kind] = written.get(kind, 0) + 1
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic corpus for the organize benchmark.")
+    parser.add_argument('folder')
+    parser.add_argument('--files', type=int, default=100)
+    parser.add_argument('--size', choices=sorted(SIZES), default='small')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    written = make_corpus(args.folder, args.files, args.size, args.seed)
+    print(", ".join(f"{count} {kind}" for kind, count in sorted(written.items())))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+#local stand-in for the groq chat completions and hugging face inference apis, so benchmarks don't spend real quota.
+#run it on its own with: python benchmarks/mock_servers.py --port=8765 --latency=0.2
+#then point fastfox at it with GROQ_BASE_URL=http://127.0.0.1:8765 and FASTFOX_HF_API_URL=http://127.0.0.1:8765/models/
+import re
+import sys
+import json
+import time
+import random
+import zlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+#topics and caption nouns the mock answers with, picked from a hash of the request so the same file always gets the same answer.
+TOPICS = ['Finance', 'Marketing', 'Sales', 'Healthcare', 'Education', 'Logistics', 'Research', 'Legal', 'Travel', 'Inventory']
+CAPTION_NOUNS = ['dog', 'beach', 'mountain', 'laptop', 'car', 'building', 'flower', 'train', 'plate', 'sunset']
+
+#latency, error and rate limit settings, shared by every request of a server.
+#loading_rate is the share of hugging face requests answered like a cold model: a 503 with an estimated_time body.
+class MockSettings:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, rate_limit_rate: float = 0.0, retry_after: float = 0.0, token_delay: float = 0.0,
+                 loading_rate: float = 0.0, estimated_time: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.token_delay = token_delay
+        self.loading_rate = loading_rate
+        self.estimated_time = estimated_time
+        self.lock = threading.Lock()
+        self.counts = {'groq': 0, 'hf': 0, 'errors': 0, 'rate_limited': 0, 'loading': 0}
+
+    def count(self, name: str):
+        with self.lock:
+            self.counts[name] += 1
+
+def pick(options, text: str) -> str:
+    return options[zlib.crc32(text.encode('utf-8', 'replace')) % len(options)]
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status: int, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        settings = self.server.settings
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        delay = settings.latency + random.uniform(0, settings.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        roll = random.random()
+        if roll < settings.rate_limit_rate:
+            settings.count('rate_limited')
+            self.send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded"}},
+                           {"Retry-After": str(settings.retry_after)})
+        elif roll < settings.rate_limit_rate + settings.error_rate:
+            settings.count('errors')
+            self.send_json(500, {"error": {"message": "Internal server error"}})
+        elif self.path.endswith('/chat/completions'):
+            settings.count('groq')
+            request = json.loads(body or b'{}')
+            if request.get('stream'):
+                self.send_stream(self.chat_completion(request))
+            else:
+                self.send_json(200, self.chat_completion(request))
+        elif self.path.startswith('/models/') and random.random() < settings.loading_rate:
+            settings.count('loading')
+            model = self.path[len('/models/'):]
+            self.send_json(503, {"error": f"Model {model} is currently loading", "estimated_time": settings.estimated_time})
+        elif self.path.startswith('/models/'):
+            settings.count('hf')
+            self.send_json(200, [{"generated_text": f"a {pick(CAPTION_NOUNS, str(len(body)) + body[-64:].hex())}"}])
+        else:
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    #sends a completion as server-sent events a few characters at a time, like a streaming groq answer.
+    def send_stream(self, completion: dict):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        content = completion['choices'][0]['message']['content']
+        chunk = {key: completion[key] for key in ('id', 'created', 'model')}
+        chunk['object'] = "chat.completion.chunk"
+        try:
+            for start in range(0, len(content), 4):
+                chunk['choices'] = [{"index": 0, "delta": {"content": content[start:start + 4]}, "finish_reason": None}]
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+                time.sleep(self.server.settings.token_delay)
+            chunk['choices'] = [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+            chunk['x_groq'] = {"id": completion['id'], "usage": completion['usage']}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n".encode('utf-8'))
+        except (BrokenPipeError, ConnectionResetError):
+            #the client stopped reading early, fastfox does that once it has the code block it needs.
+            pass
+
+    #answers like groq: a json object of topics for batch requests, a single word otherwise.
+    def chat_completion(self, request: dict) -> dict:
+        prompt = "\n".join(message.get('content', '') for message in request.get('messages', []))
+        if request.get('response_format', {}).get('type') == 'json_object':
+            file_ids = re.findall(r'^File (\S+) \(', prompt, re.MULTILINE)
+            content = json.dumps({file_id: pick(TOPICS, prompt + file_id) for file_id in file_ids})
+        elif 'command line instruction' in prompt:
+            content = f"You can use this command:\n```bash\necho {pick(TOPICS, prompt).lower()}\n```\nIt prints the word."
+        else:
+            content = pick(TOPICS, prompt)
+        prompt_tokens = len(prompt.split())
+        completion_tokens = len(content.split())
+        return {
+            "id": f"chatcmpl-mock-{random.getrandbits(32):08x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get('model', 'mock'),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "logprobs": None, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+        }
+
+#starts the mock server on a background thread, returns the server and its base url (port 0 picks a free port).
+def start_mock_server(settings: MockSettings, host: str = "127.0.0.1", port: int = 0):
+    server = ThreadingHTTPServer((host, port), MockHandler)
+    server.daemon_threads = True
+    server.settings = settings
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+def add_settings_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds every mock request takes")
+    parser.add_argument('--jitter', type=float, default=0.0, help="extra random latency, up to this many seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of requests answered with a 500")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="share of requests answered with a 429")
+    parser.add_argument('--token-delay', type=float, default=0.0, help="seconds between the chunks of a streamed answer")
+    parser.add_argument('--retry-after', type=float, default=0.0, help="Retry-After seconds sent with 429 answers")
+    parser.add_argument('--loading-rate', type=float, default=0.0, help="share of hugging face requests answered with a 503 'model is loading'")
+    parser.add_argument('--estimated-time', type=float, default=0.0, help="estimated_time seconds sent with the 503 'model is loading' answers")
+
+def settings_from_args(args) -> MockSettings:
+    return MockSettings(args.latency, args.jitter, args.error_rate, args.rate_limit_rate, args.retry_after, args.token_delay,
+                        args.loading_rate, args.estimated_time)
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve mock Groq and Hugging Face endpoints.")
+    parser.add_argument('--port', type=int, default=8765)
+    add_settings_arguments(parser)
+    args = parser.parse_args()
+
+    server, base_url = start_mock_server(settings_from_args(args), port=args.port)
+    print(f"Mock servers running, GROQ_BASE_URL={base_url} FASTFOX_HF_API_URL={base_url}/models/")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(json.dumps(server.settings.counts))
+        sys.exit(0)
+
+if __name__ == "__main__":
+    main()
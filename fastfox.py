@@ -1,26 +1,53 @@
+from __future__ import annotations
+
 import os
 import re
 import sys
 import csv
-import docx
 import json
-import base64
-import winreg
-import PyPDF2
-import requests
-import pythoncom
+import math
+import time
+import select
+import struct
+import sqlite3
+import codecs
+import zlib
+import hashlib
+import random
+import email.utils
+import functools
+import importlib
+import fnmatch
+import threading
 import subprocess
-import pandas as pd
-from groq import Groq
-import win32com.client
-from io import StringIO
-from nltk import pos_tag
-from nltk.tokenize import word_tokenize
-from contextlib import redirect_stderr, redirect_stdout
+from io import StringIO, BytesIO
+from abc import ABC, abstractmethod
+from contextlib import contextmanager, nullcontext, redirect_stderr, redirect_stdout
+from typing import TYPE_CHECKING
+from concurrent.futures import ThreadPoolExecutor
+
+#heavy modules (groq, nltk, PyPDF2, openpyxl, olefile, PIL, requests, pywin32...) are imported inside the functions that use them,
+#so every subcommand only pays for what it actually needs and `forget` starts instantly.
+#Groq is only needed by the type annotations, which type checkers read without importing it at runtime.
+if TYPE_CHECKING:
+    from groq import Groq
 
 #setting up conversation history for the bot's memory
-CONVERSATION_HISTORY = []
-HISTORY_FILE = os.path.join(os.path.expanduser("~"), ".fastfox", "history.json")
+HISTORY_FILE = os.path.join(os.path.expanduser("~"), ".fastfox", "history.db")
+#older versions kept the whole history in one json file, it gets imported into the database once.
+LEGACY_HISTORY_FILE = os.path.join(os.path.expanduser("~"), ".fastfox", "history.json")
+#entries kept per command type, the oldest ones are dropped as new ones come in.
+HISTORY_RETENTION = 200
+#history codeit puts in its prompt, in estimated tokens (about 4 characters each), override it with FASTFOX_HISTORY_TOKENS.
+HISTORY_CONTEXT_TOKENS = 1200
+#no single past answer takes more than this many tokens of it, only its lines that match the request best are kept.
+HISTORY_SNIPPET_TOKENS = 400
+#bm25 parameters of the history search, and the score added to entries about the same file.
+BM25_K1 = 1.2
+BM25_B = 0.75
+#a long request is searched with at most this many of its terms, the rarest ones in the history.
+HISTORY_QUERY_TERMS = 64
+HISTORY_PATH_BOOST = 2.0
 
 # If you want to use the exe version of the application, this setup essentially copies the batch files to the user's scripts and system paths directly once it's executed.
 #If you're running this code however, you can comment out this setup_batch_files() function and remove it from main too
@@ -28,6 +55,8 @@ HISTORY_FILE = os.path.join(os.path.expanduser("~"), ".fastfox", "history.json")
 
 #Setting up batch files and PATH so that everything works out of the box.
 def setup_batch_files():
+    import winreg
+
     batch_commands = {
         "organize": "fastfox.exe organize",
         "codeit": "fastfox.exe codeit",
@@ -64,64 +93,264 @@ def setup_batch_files():
 
     winreg.CloseKey(key)
 
-#Loading conversation history
-def load_conversation_history():
+#opens one of fastfox's sqlite databases, WAL mode and a busy timeout let several fastfox processes use it at once.
+def open_database(path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    return connection
+
+#append-only conversation history, every interaction is one insert instead of rewriting the whole history.
+#entries are indexed by command type so getting the context of a command never scans the rest of the history.
+#every entry is also added to an inverted index (history_terms: term, entry, count) for the bm25 search of codeit,
+#entries are tied to the file they were about when there is one.
+class HistoryStore:
+    def __init__(self, path: str, legacy_path: str, retention: int):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.retention = retention
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def connect(self):
+        if self.connection is None:
+            self.connection = open_database(self.path)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS history (id INTEGER PRIMARY KEY AUTOINCREMENT, command_type TEXT NOT NULL, query TEXT NOT NULL, response TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS history_command_type ON history (command_type, id)")
+            columns = {row[1] for row in self.connection.execute("PRAGMA table_info(history)")}
+            for column, column_type in (('file_path', 'TEXT'), ('length', 'INTEGER')):
+                if column not in columns:
+                    try:
+                        self.connection.execute(f"ALTER TABLE history ADD COLUMN {column} {column_type}")
+                    except sqlite3.OperationalError:
+                        #another fastfox process added it first
+                        pass
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS history_terms (term TEXT NOT NULL, entry_id INTEGER NOT NULL, count INTEGER NOT NULL, PRIMARY KEY (term, entry_id)) WITHOUT ROWID"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS history_terms_entry ON history_terms (entry_id)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS history_file_path ON history (command_type, file_path)")
+            self.connection.commit()
+            self.import_legacy_history()
+            self.index_missing()
+        return self.connection
+
+    #adds an entry's query and response to the inverted index, its length (in terms) is kept for bm25.
+    def index_entry(self, entry_id: int, query: str, response: str):
+        counts = {}
+        for term in code_term_list(f"{query}\n{response}"):
+            counts[term] = counts.get(term, 0) + 1
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO history_terms (term, entry_id, count) VALUES (?, ?, ?)",
+            [(term, entry_id, count) for term, count in counts.items()]
+        )
+        self.connection.execute("UPDATE history SET length = ? WHERE id = ?", (sum(counts.values()), entry_id))
+
+    #indexes the entries written before the index existed (or imported from history.json), once.
+    def index_missing(self):
+        rows = self.connection.execute("SELECT id, query, response FROM history WHERE length IS NULL").fetchall()
+        if rows:
+            with self.connection:
+                for entry_id, query, response in rows:
+                    self.index_entry(entry_id, query, response)
+
+    #drops entries and their index terms, entry_ids is a select of the ids to drop.
+    def delete_entries(self, connection, entry_ids: str, parameters):
+        connection.execute(f"DELETE FROM history_terms WHERE entry_id IN ({entry_ids})", parameters)
+        connection.execute(f"DELETE FROM history WHERE id IN ({entry_ids})", parameters)
+
+    #moves the entries of an old history.json into the database, the json file is removed afterwards.
+    #the write lock is taken first so two fastfox processes starting together don't both import it.
+    def import_legacy_history(self):
+        if not os.path.exists(self.legacy_path):
+            return
+        try:
+            self.connection.execute("BEGIN IMMEDIATE")
+            if os.path.exists(self.legacy_path):
+                with open(self.legacy_path, 'r') as f:
+                    entries = json.load(f)
+                self.connection.executemany(
+                    "INSERT INTO history (command_type, query, response, created_at) VALUES (?, ?, ?, ?)",
+                    [(item['command_type'], item['query'], item['response'], time.time()) for item in entries]
+                )
+                os.remove(self.legacy_path)
+            self.connection.commit()
+        except Exception as e:
+            self.connection.rollback()
+            print(f"Error loading conversation history: {str(e)}")
+
+    def add(self, command_type: str, query: str, response: str, file_path: str = None):
+        with self.lock:
+            connection = self.connect()
+            with connection:
+                cursor = connection.execute(
+                    "INSERT INTO history (command_type, query, response, created_at, file_path) VALUES (?, ?, ?, ?, ?)",
+                    (command_type, query, response, time.time(), file_path)
+                )
+                self.index_entry(cursor.lastrowid, query, response)
+                self.delete_entries(
+                    connection,
+                    "SELECT id FROM history WHERE command_type = ? AND id <= (SELECT id FROM history WHERE command_type = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                    (command_type, command_type, self.retention)
+                )
+
+    #the last `limit` entries of a command type, oldest first.
+    def recent(self, command_type: str, limit: int):
+        with self.lock:
+            rows = self.connect().execute(
+                "SELECT command_type, query, response FROM history WHERE command_type = ? ORDER BY id DESC LIMIT ?",
+                (command_type, limit)
+            ).fetchall()
+        return [{'command_type': row[0], 'query': row[1], 'response': row[2]} for row in reversed(rows)]
+
+    #the `limit` entries of a command type that match terms best (bm25), entries about file_path get HISTORY_PATH_BOOST
+    #on top. only the posting lists of the query terms are read, entries that match nothing are left out. best first.
+    def search(self, command_type: str, terms, file_path: str = None, limit: int = 5):
+        terms = list(terms)
+        with self.lock:
+            connection = self.connect()
+            entries, average_length = connection.execute(
+                "SELECT COUNT(*), AVG(length) FROM history WHERE command_type = ?", (command_type,)
+            ).fetchone()
+            if not entries:
+                return []
+            #number of entries each term is in, terms no entry has can't match and are dropped. the rarest terms weigh the
+            #most in bm25, so they're the ones kept when the request has more than HISTORY_QUERY_TERMS.
+            frequencies = {}
+            for start in range(0, len(terms), 500):
+                chunk = terms[start:start + 500]
+                frequencies.update(connection.execute(
+                    f"SELECT t.term, COUNT(*) FROM history_terms t JOIN history h ON h.id = t.entry_id "
+                    f"WHERE h.command_type = ? AND t.term IN ({', '.join('?' * len(chunk))}) GROUP BY t.term",
+                    (command_type, *chunk)
+                ).fetchall())
+            terms = sorted(frequencies, key=lambda term: (frequencies[term], term))[:HISTORY_QUERY_TERMS]
+            postings = connection.execute(
+                f"SELECT t.term, t.entry_id, t.count, h.length FROM history_terms t JOIN history h ON h.id = t.entry_id "
+                f"WHERE h.command_type = ? AND t.term IN ({', '.join('?' * len(terms))})",
+                (command_type, *terms)
+            ).fetchall() if terms else []
+            same_file = [row[0] for row in connection.execute(
+                "SELECT id FROM history WHERE command_type = ? AND file_path = ?", (command_type, file_path)
+            )] if file_path else []
+
+            scores = {entry_id: HISTORY_PATH_BOOST for entry_id in same_file}
+            average_length = average_length or 1
+            for term, entry_id, count, length in postings:
+                idf = math.log(1 + (entries - frequencies[term] + 0.5) / (frequencies[term] + 0.5))
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * (length or 0) / average_length)
+                scores[entry_id] = scores.get(entry_id, 0.0) + idf * count * (BM25_K1 + 1) / (count + norm)
+
+            best = sorted(scores, key=lambda entry_id: (scores[entry_id], entry_id), reverse=True)[:limit]
+            if not best:
+                return []
+            rows = connection.execute(
+                f"SELECT id, command_type, query, response FROM history WHERE id IN ({', '.join('?' * len(best))})", best
+            ).fetchall()
+        by_id = {row[0]: {'command_type': row[1], 'query': row[2], 'response': row[3]} for row in rows}
+        return [by_id[entry_id] for entry_id in best if entry_id in by_id]
+
+    #deletes the history of one command type, or everything when command_type is None.
+    def clear(self, command_type=None):
+        with self.lock:
+            connection = self.connect()
+            with connection:
+                if command_type is None:
+                    connection.execute("DELETE FROM history_terms")
+                    connection.execute("DELETE FROM history")
+                else:
+                    self.delete_entries(connection, "SELECT id FROM history WHERE command_type = ?", (command_type,))
+
+HISTORY = HistoryStore(HISTORY_FILE, LEGACY_HISTORY_FILE, HISTORY_RETENTION)
+
+#Adding a new chat context to the conversation history.
+def add_to_history(command_type, query, response, file_path: str = None):
+    try:
+        HISTORY.add(command_type, query, response, file_path)
+    except Exception as e:
+        print(f"Error saving conversation history: {str(e)}")
+
+#Getting the last 5 (or limit) chat contexts for a given command type.
+def get_context(command_type, query, limit: int = 5):
     try:
-        if os.path.exists(HISTORY_FILE):
-            with open(HISTORY_FILE, 'r') as f:
-                return json.load(f)
+        return HISTORY.recent(command_type, limit)
     except Exception as e:
         print(f"Error loading conversation history: {str(e)}")
-    return []
+        return []
+
+#the lines of a past answer that match terms best: the best matching line and the lines around it, up to max_chars.
+def best_snippet(text: str, terms, max_chars: int) -> str:
+    if len(text) <= max_chars:
+        return text
+    lines = text.split('\n')
+    hits = [len(code_terms(line) & terms) for line in lines]
+    best = max(range(len(lines)), key=lambda i: hits[i])
+    start, end = best, best + 1
+    size = len(lines[best]) + 1
+    if size > max_chars:
+        return lines[best][:max_chars]
+    grew = True
+    while grew:
+        grew = False
+        if end < len(lines) and size + len(lines[end]) + 1 <= max_chars:
+            size += len(lines[end]) + 1
+            end += 1
+            grew = True
+        if start > 0 and size + len(lines[start - 1]) + 1 <= max_chars:
+            start -= 1
+            size += len(lines[start]) + 1
+            grew = True
+    return ("...\n" if start > 0 else "") + "\n".join(lines[start:end]) + ("\n..." if end < len(lines) else "")
 
-#Saving conversation history
-def save_conversation_history():
+#past entries relevant to a request, for the codeit prompt: the best bm25 matches (and entries about the same file),
+#cut down to their best matching lines so all of them fit in token_budget. the prompt stays the same size however long
+#the history gets. the budget is read when called, after setup_env has loaded ~/.fastfox/.env.
+def get_relevant_context(command_type: str, query: str, file_path: str = None, token_budget: int = None, limit: int = 5):
+    if token_budget is None:
+        token_budget = get_setting('FASTFOX_HISTORY_TOKENS', HISTORY_CONTEXT_TOKENS, int)
+    terms = code_terms(query) | (code_terms(os.path.basename(file_path)) if file_path else set())
     try:
-        os.makedirs(os.path.dirname(HISTORY_FILE), exist_ok=True)
-        with open(HISTORY_FILE, 'w') as f:
-            json.dump(CONVERSATION_HISTORY, f)
+        entries = HISTORY.search(command_type, terms, file_path, limit)
     except Exception as e:
-        print(f"Error saving conversation history: {str(e)}")
+        print(f"Error loading conversation history: {str(e)}")
+        return []
 
-#Adding a new chat context to the conversation history.
-def add_to_history(command_type, query, response):
-    CONVERSATION_HISTORY.append({
-        'command_type': command_type,
-        'query': query,
-        'response': response
-    })
-    save_conversation_history()
-
-#Getting the last 5 chat contexts for a given command type.
-def get_context(command_type, query):
-    relevant_history = [
-        item for item in CONVERSATION_HISTORY 
-        if item['command_type'] == command_type
-    ]
-    return relevant_history[-5:] if relevant_history else []
+    context = []
+    chars_left = token_budget * 4
+    for entry in entries:
+        room = min(chars_left, HISTORY_SNIPPET_TOKENS * 4) - len(entry['query'])
+        if room < 80:
+            break
+        response = best_snippet(entry['response'], terms, room)
+        context.append({'command_type': entry['command_type'], 'query': entry['query'], 'response': response})
+        chars_left -= len(entry['query']) + len(response)
+    return context
 
 # Add the forget function
 def forget(query: str):
-    global CONVERSATION_HISTORY
-    
     if query.lower() == 'all':
         # Clear all history
-        CONVERSATION_HISTORY = []
-        if os.path.exists(HISTORY_FILE):
-            os.remove(HISTORY_FILE)
+        HISTORY.clear()
+        TOPIC_CACHE.clear()
+        COMMAND_CACHE.clear()
         print("All conversation history has been cleared.")
+    elif query.lower() == 'cache':
+        # Clear the organize topic cache and the command suggestion cache, files get classified again on the next run
+        TOPIC_CACHE.clear()
+        COMMAND_CACHE.clear()
+        print("Topic and command caches have been cleared.")
     else:
         # Clear history for a specific command type
         valid_commands = ['command', 'code', 'organize']
         if query.lower() in valid_commands:
-            CONVERSATION_HISTORY = [
-                item for item in CONVERSATION_HISTORY 
-                if item['command_type'] != query.lower()
-            ]
-            save_conversation_history()
+            HISTORY.clear(query.lower())
+            if query.lower() == 'command':
+                COMMAND_CACHE.clear()
             print(f"Conversation history for /{query} has been cleared.")
         else:
-            print(f"Invalid option. Use 'all' or one of: {', '.join(valid_commands)}")
+            print(f"Invalid option. Use 'all', 'cache' or one of: {', '.join(valid_commands)}")
     
     return True
 
@@ -141,30 +370,121 @@ def setup_env():
         
         print("API keys saved successfully!")
     
+    #blank lines, # comments and lines without a setting are skipped, a value can itself contain =
     with open(env_file, 'r') as f:
         for line in f:
-            key, value = line.strip().split('=')
-            os.environ[key] = value
+            key, separator, value = line.strip().partition('=')
+            if key and separator and not key.startswith('#'):
+                os.environ[key.strip()] = value.strip()
+
+NLTK_DATA_DIR = os.path.join(os.path.expanduser("~"), ".fastfox", "nltk_data")
+#written once the nltk data packages are in place, it holds the nltk version they were checked for.
+NLTK_READY_FLAG = os.path.join(NLTK_DATA_DIR, ".ready")
 
 #downloading nltk(natural language toolkit) packages silently, this is to avoid the annoying nltk download prompts.
 #the nltk module is what gives the folder names by picking the most common words in the text.
 def silent_nltk_download(package):
     try:
-        nltk_data_dir = os.path.join(os.path.expanduser("~"), ".fastfox", "nltk_data")
-        os.makedirs(nltk_data_dir, exist_ok=True)
+        os.makedirs(NLTK_DATA_DIR, exist_ok=True)
         
         import nltk
-        nltk.data.path.append(nltk_data_dir)
+        if NLTK_DATA_DIR not in nltk.data.path:
+            nltk.data.path.append(NLTK_DATA_DIR)
         
         with redirect_stdout(StringIO()), redirect_stderr(StringIO()):
-            nltk.download(package, download_dir=nltk_data_dir, quiet=True)
+            nltk.download(package, download_dir=NLTK_DATA_DIR, quiet=True)
     except Exception as e:
         print(f"Error downloading {package}: {e}")
 
-#initializing the groq and huggingface api clients.
+#data packages needed by the tokenizer and the tagger, nltk 3.9 renamed them.
+def nltk_packages(nltk_version: str):
+    version = tuple(int(part) for part in re.findall(r'\d+', nltk_version)[:2])
+    if version >= (3, 9):
+        return [('punkt_tab', 'tokenizers/punkt_tab'), ('averaged_perceptron_tagger_eng', 'taggers/averaged_perceptron_tagger_eng')]
+    return [('punkt', 'tokenizers/punkt'), ('averaged_perceptron_tagger', 'taggers/averaged_perceptron_tagger')]
+
+#makes sure the nltk data packages are downloaded, this is only checked once per nltk version instead of on every run.
+def ensure_nltk_data():
+    from importlib.metadata import version, PackageNotFoundError
+    #the version comes from the package metadata so nltk isn't imported when its data is already there, the .exe build
+    #has no metadata and asks nltk itself
+    try:
+        nltk_version = version('nltk')
+    except PackageNotFoundError:
+        import nltk
+        nltk_version = nltk.__version__
+    try:
+        with open(NLTK_READY_FLAG, 'r') as f:
+            if f.read().strip() == nltk_version:
+                return
+    except OSError:
+        pass
+
+    print("Initializing Natural Language Toolkit...")
+    import nltk
+    if NLTK_DATA_DIR not in nltk.data.path:
+        nltk.data.path.append(NLTK_DATA_DIR)
+    ready = True
+    for package, resource in nltk_packages(nltk_version):
+        try:
+            nltk.data.find(resource)
+        except LookupError:
+            silent_nltk_download(package)
+            try:
+                nltk.data.find(resource)
+            except LookupError:
+                ready = False
+
+    #the flag is only written once everything is in place, a failed download is retried on the next run
+    if ready:
+        os.makedirs(NLTK_DATA_DIR, exist_ok=True)
+        with open(NLTK_READY_FLAG, 'w') as f:
+            f.write(nltk_version)
+
+#imports the nltk tokenizer, pointing nltk at the data folder fastfox downloads into.
+def load_nltk():
+    import nltk
+    from nltk.tokenize import word_tokenize
+    if NLTK_DATA_DIR not in nltk.data.path:
+        nltk.data.path.append(NLTK_DATA_DIR)
+    return word_tokenize
+
+TAGGER = None
+TAGGER_LOCK = threading.Lock()
+
+#loads the nltk perceptron tagger once and keeps it warm, nltk.pos_tag loads the whole model again on every call.
+def get_tagger():
+    global TAGGER
+    if TAGGER is None:
+        with TAGGER_LOCK:
+            if TAGGER is None:
+                load_nltk()
+                from nltk.tag.perceptron import PerceptronTagger
+                TAGGER = PerceptronTagger()
+    return TAGGER
+
+#modules each subcommand can end up using, preload_modules imports them ahead of time (benchmarks use it to time each subcommand).
+SUBCOMMAND_MODULES = {
+    'command': ['groq'],
+    'codeit': ['groq'],
+    'organize': ['groq', 'requests', 'nltk', 'PyPDF2', 'openpyxl', 'xlrd', 'olefile', 'PIL.Image'],
+    'forget': [],
+    'train': ['numpy', 'PyPDF2', 'openpyxl', 'xlrd', 'olefile']
+}
+
+def preload_modules(command_type: str):
+    for module_name in SUBCOMMAND_MODULES.get(command_type, []):
+        try:
+            importlib.import_module(module_name)
+        except ImportError:
+            pass
+
+#initializing the groq and huggingface api clients, the api keys must already be loaded by setup_env().
+#the clients are made once per process, so a resident server (fastfox serve) reuses them for every request.
+@functools.lru_cache(maxsize=1)
 def initialize():
-    setup_env()
-    
+    from groq import Groq
+
     groq_api_key = os.getenv('GROQ_API_KEY')
     hf_token = os.getenv('HUGGINGFACE_API_TOKEN')
     
@@ -174,13 +494,470 @@ def initialize():
     
     return Groq(api_key=groq_api_key), {"Authorization": f"Bearer {hf_token}"}
 
-HF_API_URL = "https://api-inference.huggingface.co/models/"
+#set FASTFOX_HF_API_URL to send caption requests somewhere else, like the benchmark mock server (GROQ_BASE_URL does the same for groq).
+HF_API_URL = os.getenv('FASTFOX_HF_API_URL', "https://api-inference.huggingface.co/models/")
+
+#number of files organize classifies at the same time, can be changed with --workers=N
+DEFAULT_WORKERS = 4
+
+QUOTA_FILE = os.path.join(os.path.expanduser("~"), ".fastfox", "quota.db")
+#free tier budgets as (window seconds, requests, tokens) per provider, they apply to each model separately.
+#groq allows 30 requests and 30k tokens a minute and 14,400 requests and 500k tokens a day,
+#hugging face 50 requests an hour and 1,000 a day.
+QUOTAS = {
+    'groq': [(60, 30, 30000), (86400, 14400, 500000)],
+    'hf': [(3600, 50, None), (86400, 1000, None)],
+}
+#interactive calls (command, codeit) go before batch ones (organize), and batch calls leave this share of every budget free
+#so an interactive call never waits behind a bulk run.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+INTERACTIVE_RESERVE = 0.2
+
+#api quota ledger shared by every fastfox process through a sqlite database: each call is recorded with its tokens,
+#and a call only goes out once it fits in all the budgets of its provider and model.
+#callers waiting for quota are registered too, batch calls hold back while an interactive call is waiting.
+class QuotaLedger:
+    def __init__(self, path: str, quotas: dict):
+        self.path = path
+        self.quotas = quotas
+        self.enabled = True
+        self.lock = threading.Lock()
+        self.connection = None
+        self.pruned_at = 0.0
+
+    def connect(self):
+        if self.connection is None:
+            self.connection = open_database(self.path)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS calls (id INTEGER PRIMARY KEY AUTOINCREMENT, bucket TEXT NOT NULL, at REAL NOT NULL, tokens INTEGER NOT NULL, priority INTEGER NOT NULL)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS calls_bucket_at ON calls (bucket, at)")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS waiting (id INTEGER PRIMARY KEY AUTOINCREMENT, bucket TEXT NOT NULL, priority INTEGER NOT NULL, seen REAL NOT NULL)"
+            )
+            self.connection.commit()
+        return self.connection
+
+    #how long a call has to wait before it fits every budget, 0 when it can go now.
+    def wait_time(self, connection, provider: str, bucket: str, tokens: int, priority: int, now: float) -> float:
+        share = 1.0 if priority == PRIORITY_INTERACTIVE else 1.0 - INTERACTIVE_RESERVE
+        wait = 0.0
+        for window, max_requests, max_tokens in self.quotas.get(provider, []):
+            rows = connection.execute(
+                "SELECT at, tokens FROM calls WHERE bucket = ? AND at > ? ORDER BY at", (bucket, now - window)
+            ).fetchall()
+            request_limit = max(1, int(max_requests * share))
+            if len(rows) >= request_limit:
+                wait = max(wait, rows[len(rows) - request_limit][0] + window - now)
+            if max_tokens:
+                token_limit = max_tokens * share
+                used = sum(row[1] for row in rows)
+                for at, row_tokens in rows:
+                    if used + tokens <= token_limit:
+                        break
+                    used -= row_tokens
+                    wait = max(wait, at + window - now)
+        return wait
+
+    #blocks until a call of about `tokens` tokens fits the budgets, records it and returns its id for settle().
+    def acquire(self, provider: str, model: str, tokens: int = 0, priority: int = PRIORITY_BATCH):
+        if not self.enabled:
+            return None
+        bucket = f"{provider}:{model}"
+        waiting_id = None
+        try:
+            while True:
+                with self.lock:
+                    connection = self.connect()
+                    now = time.time()
+                    connection.execute("BEGIN IMMEDIATE")
+                    try:
+                        if waiting_id is None:
+                            waiting_id = connection.execute(
+                                "INSERT INTO waiting (bucket, priority, seen) VALUES (?, ?, ?)", (bucket, priority, now)
+                            ).lastrowid
+                        else:
+                            connection.execute("UPDATE waiting SET seen = ? WHERE id = ?", (now, waiting_id))
+                        ahead = connection.execute(
+                            "SELECT COUNT(*) FROM waiting WHERE bucket = ? AND priority < ? AND seen > ?", (bucket, priority, now - 10)
+                        ).fetchone()[0]
+                        wait = 1.0 if ahead else self.wait_time(connection, provider, bucket, tokens, priority, now)
+                        if wait <= 0:
+                            ticket = connection.execute(
+                                "INSERT INTO calls (bucket, at, tokens, priority) VALUES (?, ?, ?, ?)", (bucket, now, tokens, priority)
+                            ).lastrowid
+                            connection.execute("DELETE FROM waiting WHERE id = ?", (waiting_id,))
+                            waiting_id = None
+                            if now - self.pruned_at > 60:
+                                longest = max([window for windows in self.quotas.values() for window, _, _ in windows] + [0])
+                                connection.execute("DELETE FROM calls WHERE at < ?", (now - longest,))
+                                connection.execute("DELETE FROM waiting WHERE seen < ?", (now - 60,))
+                                self.pruned_at = now
+                        connection.commit()
+                    except BaseException:
+                        connection.rollback()
+                        raise
+                if wait <= 0:
+                    return ticket
+                time.sleep(min(wait, 1.0))
+        finally:
+            if waiting_id is not None:
+                with self.lock:
+                    self.connection.execute("DELETE FROM waiting WHERE id = ?", (waiting_id,))
+                    self.connection.commit()
+
+    #replaces the token estimate of a recorded call with the tokens it actually used.
+    def settle(self, ticket, tokens: int):
+        if ticket is None:
+            return
+        with self.lock:
+            self.connect().execute("UPDATE calls SET tokens = ? WHERE id = ?", (tokens, ticket))
+            self.connection.commit()
+
+    #requests a batch run can still make in the longest budget window of a provider and model.
+    def remaining(self, provider: str, model: str) -> int:
+        windows = self.quotas.get(provider)
+        if not self.enabled or not windows:
+            return sys.maxsize
+        window, max_requests, _ = max(windows)
+        with self.lock:
+            used = self.connect().execute(
+                "SELECT COUNT(*) FROM calls WHERE bucket = ? AND at > ?", (f"{provider}:{model}", time.time() - window)
+            ).fetchone()[0]
+        return max(0, int(max_requests * (1.0 - INTERACTIVE_RESERVE)) - used)
+
+QUOTA = QuotaLedger(QUOTA_FILE, QUOTAS)
+
+#rough token count of a request before it's sent, about 4 characters per token plus the answer's max_tokens.
+def estimate_tokens(messages, max_tokens: int) -> int:
+    return sum(len(str(message.get('content', ''))) for message in messages) // 4 + max_tokens
+
+#sending a chat completion request to groq and returning the text, every groq call goes through here so it's rate limited.
+#these are batch calls (organize), they give way to interactive ones in the quota ledger.
+def groq_chat(groq_client: Groq, messages, model="llama3-8b-8192", max_tokens=50, priority: int = PRIORITY_BATCH, **kwargs) -> str:
+    with TRACER.span('rate_limit.groq'):
+        ticket = QUOTA.acquire('groq', model, estimate_tokens(messages, max_tokens), priority)
+    with TRACER.span('api.groq', model=model) as span:
+        chat_completion = groq_client.chat.completions.create(
+            messages=messages,
+            model=model,
+            max_tokens=max_tokens,
+            **kwargs
+        )
+        usage = getattr(chat_completion, 'usage', None)
+        if usage is not None:
+            span['tokens_in'] = usage.prompt_tokens
+            span['tokens_out'] = usage.completion_tokens
+            QUOTA.settle(ticket, usage.prompt_tokens + usage.completion_tokens)
+    return chat_completion.choices[0].message.content.strip()
+
+#streaming version of groq_chat: on_text gets every piece of the answer as soon as it arrives and can return True to
+#stop reading (the rest of the answer isn't needed), returns the whole text received like groq_chat.
+#streamed answers are read by someone waiting at the terminal, so they're interactive calls by default.
+def groq_stream(groq_client: Groq, messages, on_text, model="llama3-8b-8192", max_tokens=50, priority: int = PRIORITY_INTERACTIVE, **kwargs) -> str:
+    with TRACER.span('rate_limit.groq'):
+        ticket = QUOTA.acquire('groq', model, estimate_tokens(messages, max_tokens), priority)
+    parts = []
+    with TRACER.span('api.groq', model=model, stream=True) as span:
+        start = time.perf_counter()
+        stream = groq_client.chat.completions.create(
+            messages=messages,
+            model=model,
+            max_tokens=max_tokens,
+            stream=True,
+            **kwargs
+        )
+        try:
+            for chunk in stream:
+                usage = getattr(getattr(chunk, 'x_groq', None), 'usage', None) or getattr(chunk, 'usage', None)
+                if usage is not None:
+                    span['tokens_in'] = usage.prompt_tokens
+                    span['tokens_out'] = usage.completion_tokens
+                    QUOTA.settle(ticket, usage.prompt_tokens + usage.completion_tokens)
+                text = chunk.choices[0].delta.content if chunk.choices else None
+                if not text:
+                    continue
+                if not parts:
+                    span['first_token_ms'] = round((time.perf_counter() - start) * 1000, 3)
+                parts.append(text)
+                if on_text(text):
+                    break
+        finally:
+            stream.close()
+    return "".join(parts).strip()
+
+#prints streamed text as it arrives.
+def print_stream(text: str):
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+#follows a streamed answer and finds the first fenced code block as soon as its closing fence arrives.
+#the pattern is only searched again when a new ``` shows up, and the first match can't change once found,
+#so the result is the same as running the pattern on the complete answer.
+class FenceWatcher:
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.text = ""
+        self.match = None
+
+    def feed(self, text: str) -> bool:
+        searched = max(0, len(self.text) - 2)
+        self.text += text
+        if self.match is None and '```' in self.text[searched:]:
+            self.match = self.pattern.search(self.text)
+        return self.match is not None
+
+#models used to classify files, they're part of the topic cache key so switching models never reuses stale folder names.
+TOPIC_MODEL = "llama3-8b-8192"
+CAPTION_MODEL = "Salesforce/blip-image-captioning-large"
+
+#bump this whenever the topic prompts or the folder name post-processing change, old cache entries are then ignored.
+TOPIC_PROMPT_VERSION = 2
+
+CACHE_FILE = os.path.join(os.path.expanduser("~"), ".fastfox", "cache.db")
+#the topic cache evicts the least recently used entries once it grows past this size, override it with FASTFOX_CACHE_MAX_BYTES.
+CACHE_MAX_BYTES = 16 * 1024 * 1024
+#number of image perceptual hashes kept for near-duplicate photo lookups.
+IMAGE_HASH_LIMIT = 10000
+
+#returns the sha256 of a file's content, read in chunks so big files never sit in memory.
+def file_digest(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+#persistent topic cache, maps content hash + model + prompt version to the final folder name.
+#it lives in a sqlite database so it survives between runs and is shared by all the organize workers.
+#max_bytes None reads FASTFOX_CACHE_MAX_BYTES on first use, after setup_env has loaded ~/.fastfox/.env.
+class TopicCache:
+    def __init__(self, path: str, max_bytes: int = None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.enabled = True
+        self.lock = threading.Lock()
+        self.connection = None
+        self.total_size = 0
+
+    def connect(self):
+        if self.connection is None:
+            if self.max_bytes is None:
+                self.max_bytes = get_setting('FASTFOX_CACHE_MAX_BYTES', CACHE_MAX_BYTES, int)
+            self.connection = open_database(self.path)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS topics (key TEXT PRIMARY KEY, folder TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS topics_last_used ON topics (last_used)")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS image_hashes (id INTEGER PRIMARY KEY AUTOINCREMENT, hash TEXT NOT NULL, folder TEXT NOT NULL)"
+            )
+            self.connection.commit()
+            self.total_size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM topics").fetchone()[0]
+        return self.connection
+
+    def get(self, key: str):
+        with self.lock:
+            connection = self.connect()
+            row = connection.execute("SELECT folder FROM topics WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE topics SET last_used = ? WHERE key = ?", (time.time(), key))
+            connection.commit()
+            return row[0]
+
+    def put(self, key: str, folder: str):
+        size = len(key) + len(folder.encode('utf-8')) + 64
+        with self.lock:
+            connection = self.connect()
+            old = connection.execute("SELECT size FROM topics WHERE key = ?", (key,)).fetchone()
+            connection.execute(
+                "INSERT OR REPLACE INTO topics (key, folder, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, folder, size, time.time())
+            )
+            self.total_size += size - (old[0] if old else 0)
+            if self.total_size > self.max_bytes:
+                self.evict(connection)
+            connection.commit()
+
+    #drops the least recently used entries until the cache is back to 90% of its size limit.
+    def evict(self, connection):
+        target = self.max_bytes * 0.9
+        stale_keys = []
+        for key, size in connection.execute("SELECT key, size FROM topics ORDER BY last_used"):
+            if self.total_size <= target:
+                break
+            stale_keys.append((key,))
+            self.total_size -= size
+        connection.executemany("DELETE FROM topics WHERE key = ?", stale_keys)
+
+    #looks for a captioned image whose perceptual hash is within max_distance bits of image_hash.
+    def find_similar_image(self, image_hash: int, max_distance: int):
+        with self.lock:
+            connection = self.connect()
+            best_folder, best_distance = None, max_distance + 1
+            for stored_hash, folder in connection.execute("SELECT hash, folder FROM image_hashes"):
+                distance = bin(int(stored_hash, 16) ^ image_hash).count('1')
+                if distance < best_distance:
+                    best_folder, best_distance = folder, distance
+            return best_folder
+
+    #remembers the folder of a captioned image, only the newest IMAGE_HASH_LIMIT hashes are kept.
+    def put_image_hash(self, image_hash: int, folder: str):
+        with self.lock:
+            connection = self.connect()
+            connection.execute("INSERT INTO image_hashes (hash, folder) VALUES (?, ?)", (f"{image_hash:016x}", folder))
+            connection.execute(
+                "DELETE FROM image_hashes WHERE id <= (SELECT MAX(id) FROM image_hashes) - ?", (IMAGE_HASH_LIMIT,)
+            )
+            connection.commit()
+
+    def clear(self):
+        with self.lock:
+            connection = self.connect()
+            connection.execute("DELETE FROM topics")
+            connection.execute("DELETE FROM image_hashes")
+            connection.commit()
+            self.total_size = 0
+
+TOPIC_CACHE = TopicCache(CACHE_FILE)
+
+#topic cache key of a file for the given kind of classification and model.
+def topic_cache_key(file_path: str, kind: str, model: str) -> str:
+    return f"{file_digest(file_path)}:{kind}:{model}:v{TOPIC_PROMPT_VERSION}"
+
+#returns the folder name for a file, only calling get_topic (and so the api) when this content hasn't been classified before.
+def cached_topic(file_path: str, kind: str, model: str, get_topic) -> str:
+    if not TOPIC_CACHE.enabled:
+        return get_topic()
+    key = topic_cache_key(file_path, kind, model)
+    topic = TOPIC_CACHE.get(key)
+    if topic is None:
+        topic = get_topic()
+        TOPIC_CACHE.put(key, topic)
+    return topic
+
+COMMAND_MODEL = "llama3-8b-8192"
+#cached command suggestions expire after this many seconds (a week), override it with FASTFOX_COMMAND_CACHE_TTL.
+COMMAND_CACHE_TTL = 7 * 24 * 3600
+#number of cached command suggestions kept, the least recently used ones go first.
+COMMAND_CACHE_SIZE = 500
+#with --fuzzy, a past query at least this similar (difflib ratio) reuses its command.
+COMMAND_FUZZY_CUTOFF = 0.9
+
+#lowercases a query and drops extra whitespace, quotes and trailing punctuation, so retyped queries hit the cache.
+def normalize_query(query: str) -> str:
+    return re.sub(r'\s+', ' ', query.casefold()).strip(' "\'.?!')
+
+#cache of suggested commands keyed on the normalized query, the model and the os (the same task has different commands on windows).
+#it's another table of the topic cache database, entries expire after ttl seconds. ttl None reads FASTFOX_COMMAND_CACHE_TTL
+#on first use, after setup_env has loaded ~/.fastfox/.env.
+class CommandCache:
+    def __init__(self, path: str, ttl: int = None, max_entries: int = COMMAND_CACHE_SIZE):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def connect(self):
+        if self.connection is None:
+            if self.ttl is None:
+                self.ttl = get_setting('FASTFOX_COMMAND_CACHE_TTL', COMMAND_CACHE_TTL, int)
+            self.connection = open_database(self.path)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS commands (key TEXT PRIMARY KEY, command TEXT NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            self.connection.commit()
+        return self.connection
+
+    def key(self, query: str) -> str:
+        return f"{os.name}:{COMMAND_MODEL}:{normalize_query(query)}"
+
+    def get(self, query: str):
+        with self.lock:
+            connection = self.connect()
+            row = connection.execute(
+                "SELECT command FROM commands WHERE key = ? AND created_at > ?", (self.key(query), time.time() - self.ttl)
+            ).fetchone()
+            if row is not None:
+                connection.execute("UPDATE commands SET last_used = ? WHERE key = ?", (time.time(), self.key(query)))
+                connection.commit()
+            return row[0] if row else None
+
+    def put(self, query: str, command: str):
+        now = time.time()
+        with self.lock:
+            connection = self.connect()
+            connection.execute("INSERT OR REPLACE INTO commands (key, command, created_at, last_used) VALUES (?, ?, ?, ?)",
+                               (self.key(query), command, now, now))
+            connection.execute("DELETE FROM commands WHERE created_at <= ?", (now - self.ttl,))
+            connection.execute(
+                "DELETE FROM commands WHERE key IN (SELECT key FROM commands ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (self.max_entries,)
+            )
+            connection.commit()
+
+    def clear(self):
+        with self.lock:
+            connection = self.connect()
+            connection.execute("DELETE FROM commands")
+            connection.commit()
+
+COMMAND_CACHE = CommandCache(CACHE_FILE)
+
+#finds the command of the most similar past query in the command history, None when nothing is close enough.
+def similar_command(query: str):
+    import difflib
+
+    normalized = normalize_query(query)
+    best, best_ratio = None, COMMAND_FUZZY_CUTOFF
+    for entry in get_context('command', query, limit=HISTORY_RETENTION):
+        ratio = difflib.SequenceMatcher(None, normalized, normalize_query(entry['query'])).ratio()
+        if ratio >= best_ratio:
+            best, best_ratio = entry, ratio
+    return best
+
+#looks the query up in the command cache, and with fuzzy in the command history too.
+def cached_command(query: str, fuzzy: bool):
+    try:
+        command = COMMAND_CACHE.get(query)
+    except Exception as e:
+        print(f"Error loading the command cache: {str(e)}")
+        return None
+    if command is None and fuzzy:
+        entry = similar_command(query)
+        if entry is not None:
+            print(f"Reusing the command suggested for \"{entry['query']}\"")
+            command = entry['response']
+    return command
 
 #suggesting command function, it suggests command based on user query. 
 #it uses the llama3-8b model for it as it's lightweight and fast and near accurate too.
-def suggest_command(query: str, groq_client: Groq):
+#the answer is printed while it streams in and reading stops once the code block is complete.
+#suggestions are cached per normalized query, use_cache=False (--fresh) always asks the model, fuzzy (--fuzzy) also reuses
+#the command of a very similar past query. the groq client is only created when the model is actually needed.
+def suggest_command(query: str, groq_client: Groq = None, use_cache: bool = True, fuzzy: bool = False):
+    command = cached_command(query, fuzzy) if use_cache else None
+    if command is not None:
+        print(f"Suggested command: {command}")
+        run_suggested_command(command)
+        return
+
+    if groq_client is None:
+        groq_client, _ = initialize()
+
+    command_pattern = re.compile(r"```(?:\w+)?\n(.*?)\n```", re.DOTALL)
+    watcher = FenceWatcher(command_pattern)
+
+    def on_text(text: str) -> bool:
+        print_stream(text)
+        return watcher.feed(text)
+
     try:
-        chat_completion = groq_client.chat.completions.create(
+        groq_stream(
+            groq_client,
+            on_text=on_text,
             messages=[
                 {
                     "role": "system",
@@ -191,30 +968,24 @@ def suggest_command(query: str, groq_client: Groq):
                     "content": f"Suggest a command line instruction for the following task: {query}"
                 }
             ],
-            model="llama3-8b-8192",
+            model=COMMAND_MODEL,
             max_tokens=100
         )
+        print()
         
-        full_response = chat_completion.choices[0].message.content.strip()
-        
-        command_pattern = re.compile(r"```(?:\w+)?\n(.*?)\n```", re.DOTALL)
-        match = command_pattern.search(full_response)
+        match = watcher.match
         
         if match:
             command = match.group(1).strip()
             
             if command:
+                try:
+                    COMMAND_CACHE.put(query, command)
+                except Exception as e:
+                    print(f"Error saving the command cache: {str(e)}")
+                add_to_history('command', query, command)
                 print(f"Suggested command: {command}")
-                
-                user_input = input("Do you want to run this command? (y/n): ").lower()
-                if user_input == 'y':
-                    try:
-                        subprocess.run(command, shell=True, check=True)
-                        print("Command executed successfully.")
-                    except subprocess.CalledProcessError as e:
-                        print(f"Error executing command: {e}")
-                else:
-                    print("Command execution cancelled.")
+                run_suggested_command(command)
             else:
                 print("Error: No valid command found in the response.")
         else:
@@ -222,24 +993,287 @@ def suggest_command(query: str, groq_client: Groq):
     except Exception as e:
         print(f"Error generating command suggestion: {str(e)}")
 
+#asks before running a suggested command.
+def run_suggested_command(command: str):
+    user_input = input("Do you want to run this command? (y/n): ").lower()
+    if user_input == 'y':
+        try:
+            #behind the server, the command runs in the client's terminal and folder.
+            client = CURRENT_CLIENT.get()
+            if client is not None:
+                returncode = client.run(command)
+            else:
+                returncode = subprocess.run(command, shell=True).returncode
+            if returncode != 0:
+                raise subprocess.CalledProcessError(returncode, command)
+            print("Command executed successfully.")
+        except subprocess.CalledProcessError as e:
+            print(f"Error executing command: {e}")
+    else:
+        print("Command execution cancelled.")
+
+#reads a numeric setting from the environment (or ~/.fastfox/.env), falling back to the default.
+def get_setting(name: str, default, cast=float):
+    try:
+        return cast(os.getenv(name, default))
+    except ValueError:
+        return default
+
+#holds a module setting that a thread can replace for itself only. the server runs quick calls next to an organize run,
+#each of them gets its own client, tracer and stats this way while organize and its worker threads share theirs.
+#other attributes are looked up on the current value, so it's used like the object it holds.
+class PerThread:
+    def __init__(self, value=None):
+        self.shared = value
+        self.local = threading.local()
+
+    def get(self):
+        return getattr(self.local, 'value', self.shared)
+
+    def set(self, value, shared: bool = True):
+        if shared:
+            self.shared = value
+        else:
+            self.local.value = value
+
+    def __getattr__(self, name: str):
+        return getattr(self.get(), name)
+
+#keeps request counts, retries and latencies of an api so slow or flaky runs can be tuned.
+class CallStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.latencies = []
+
+    def record(self, latency: float):
+        with self.lock:
+            self.requests += 1
+            self.latencies.append(latency)
+
+    def record_retry(self):
+        with self.lock:
+            self.retries += 1
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+
+    def describe(self, name: str) -> str:
+        with self.lock:
+            latencies = sorted(self.latencies)
+            if not latencies:
+                return f"{name}: no requests"
+            p50 = latencies[len(latencies) // 2]
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            return (f"{name}: {self.requests} requests, {self.retries} retries, {self.failures} failures, "
+                    f"latency p50 {p50:.2f}s p95 {p95:.2f}s max {latencies[-1]:.2f}s")
+
+HF_STATS = PerThread(CallStats())
+
+#records how long each stage of a run takes (extraction, tagging, api calls, moves) as spans.
+#every span goes into the per-stage summary printed by --stats, and with --trace=file.jsonl each one is also written
+#as a json line, --prom=file.prom writes the summary as a prometheus textfile at the end of the run.
+class Tracer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.counters = {}
+        self.trace_file = None
+        #when set to a list, every span is also kept there (extraction workers send their spans back to organize)
+        self.spans = None
+
+    def open_trace(self, path: str):
+        self.trace_file = open(path, 'a', encoding='utf-8')
+
+    #times the block and records it under name, the yielded dict takes extra attributes like tokens or retries.
+    @contextmanager
+    def span(self, name: str, **attributes):
+        started = time.time()
+        start = time.perf_counter()
+        error = None
+        try:
+            yield attributes
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self.record(name, time.perf_counter() - start, started, error, attributes)
+
+    def record(self, name: str, duration: float, started: float, error, attributes: dict):
+        with self.lock:
+            if self.spans is not None:
+                self.spans.append((name, duration, started, error, attributes))
+            self.stages.setdefault(name, []).append(duration)
+            for key, value in attributes.items():
+                if key in ('tokens_in', 'tokens_out', 'retries') and value:
+                    self.counters[(name, key)] = self.counters.get((name, key), 0) + value
+            if error:
+                self.counters[(name, 'errors')] = self.counters.get((name, 'errors'), 0) + 1
+            if self.trace_file is not None:
+                entry = {'ts': round(started, 6), 'span': name, 'ms': round(duration * 1000, 3), 'thread': threading.current_thread().name}
+                entry.update(attributes)
+                if error:
+                    entry['error'] = error
+                self.trace_file.write(json.dumps(entry) + "\n")
+                self.trace_file.flush()
+
+    def percentile(self, durations, share: float) -> float:
+        return durations[min(len(durations) - 1, int(len(durations) * share))]
+
+    #per-stage table for --stats.
+    def summary(self) -> str:
+        with self.lock:
+            lines = [f"{'stage':<18}{'calls':>7}{'total s':>9}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}  totals"]
+            for name in sorted(self.stages):
+                durations = sorted(self.stages[name])
+                totals = ", ".join(f"{key} {value}" for (stage, key), value in sorted(self.counters.items()) if stage == name)
+                lines.append(f"{name:<18}{len(durations):>7}{sum(durations):>9.2f}{self.percentile(durations, 0.5) * 1000:>9.1f}"
+                             f"{self.percentile(durations, 0.95) * 1000:>9.1f}{durations[-1] * 1000:>9.1f}  {totals}")
+            return "\n".join(lines)
+
+    #writes the stage summary in the prometheus text format, through a temp file so a collector never reads half of it.
+    def write_prometheus(self, path: str):
+        with self.lock:
+            lines = [
+                "# HELP fastfox_stage_seconds Time spent in each fastfox stage.",
+                "# TYPE fastfox_stage_seconds summary"
+            ]
+            for name in sorted(self.stages):
+                durations = sorted(self.stages[name])
+                for quantile in (0.5, 0.95):
+                    lines.append(f'fastfox_stage_seconds{{stage="{name}",quantile="{quantile}"}} {self.percentile(durations, quantile):.6f}')
+                lines.append(f'fastfox_stage_seconds_sum{{stage="{name}"}} {sum(durations):.6f}')
+                lines.append(f'fastfox_stage_seconds_count{{stage="{name}"}} {len(durations)}')
+            for key, metric, description in (('tokens_in', 'fastfox_tokens_in_total', "Prompt tokens sent."),
+                                             ('tokens_out', 'fastfox_tokens_out_total', "Completion tokens received."),
+                                             ('retries', 'fastfox_retries_total', "Retried api requests."),
+                                             ('errors', 'fastfox_errors_total', "Stages that raised an error.")):
+                lines += [f"# HELP {metric} {description}", f"# TYPE {metric} counter"]
+                for (stage, name), value in sorted(self.counters.items()):
+                    if name == key:
+                        lines.append(f'{metric}{{stage="{stage}"}} {value}')
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(path + ".tmp", path)
+
+    def close(self):
+        if self.trace_file is not None:
+            self.trace_file.close()
+            self.trace_file = None
+
+TRACER = PerThread(Tracer())
+
+#decorator that runs a function inside a tracer span, the file name is recorded when the first argument is a path.
+def traced(name: str, record_file: bool = True):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            attributes = {'file': os.path.basename(args[0])} if record_file and args and isinstance(args[0], str) else {}
+            with TRACER.span(name, **attributes):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+HTTP_SESSION = None
+HTTP_SESSION_LOCK = threading.Lock()
+
+#shared requests session, its connection pool keeps connections to the inference api alive between images.
+def get_http_session():
+    global HTTP_SESSION
+    if HTTP_SESSION is None:
+        with HTTP_SESSION_LOCK:
+            if HTTP_SESSION is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=get_setting('FASTFOX_HTTP_POOL_SIZE', 16, int))
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                HTTP_SESSION = session
+    return HTTP_SESSION
+
+#how long to wait before retrying a failed request: Retry-After and the "model is loading" estimated_time are honoured,
+#anything else gets a jittered exponential backoff.
+def retry_delay(response, attempt: int) -> float:
+    backoff_base = get_setting('FASTFOX_HF_BACKOFF_BASE', 1.0)
+    backoff_max = get_setting('FASTFOX_HF_BACKOFF_MAX', 60.0)
+    if response is not None:
+        retry_after = response.headers.get('Retry-After')
+        if retry_after:
+            try:
+                return min(float(retry_after), backoff_max * 2)
+            except ValueError:
+                try:
+                    retry_at = email.utils.parsedate_to_datetime(retry_after)
+                    return min(max(0.0, retry_at.timestamp() - time.time()), backoff_max * 2)
+                except (TypeError, ValueError):
+                    pass
+        try:
+            estimated_time = float(response.json().get('estimated_time'))
+            return min(estimated_time * random.uniform(1.0, 1.2), backoff_max * 2)
+        except (ValueError, TypeError, AttributeError):
+            pass
+    return random.uniform(0, min(backoff_max, backoff_base * 2 ** attempt))
+
 #querying huggingface api and returning the response.
-def query_huggingface_api(payload, model, hf_headers):
-    response = requests.post(HF_API_URL + model, headers=hf_headers, json=payload)
-    return response.json()
+#raw bytes (like an image) can be sent as data instead of a json payload, which saves the base64 overhead.
+#cold models (503), rate limits (429), server errors and dropped connections are retried with backoff.
+def query_huggingface_api(payload, model, hf_headers, data=None):
+    import requests
+
+    session = get_http_session()
+    timeout = (get_setting('FASTFOX_HF_CONNECT_TIMEOUT', 10.0), get_setting('FASTFOX_HF_READ_TIMEOUT', 60.0))
+    max_retries = get_setting('FASTFOX_HF_MAX_RETRIES', 5, int)
+
+    with TRACER.span('api.hf', model=model, bytes=len(data) if data is not None else 0) as span:
+        for attempt in range(max_retries + 1):
+            span['retries'] = attempt
+            with TRACER.span('rate_limit.hf'):
+                QUOTA.acquire('hf', model)
+            start = time.monotonic()
+            response = None
+            try:
+                if data is not None:
+                    response = session.post(HF_API_URL + model, headers=hf_headers, data=data, timeout=timeout)
+                else:
+                    response = session.post(HF_API_URL + model, headers=hf_headers, json=payload, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == max_retries:
+                    HF_STATS.record_failure()
+                    raise
+            else:
+                HF_STATS.record(time.monotonic() - start)
+                span['status'] = response.status_code
+                if response.status_code not in (429, 500, 502, 503, 504) or attempt == max_retries:
+                    if response.status_code >= 400:
+                        HF_STATS.record_failure()
+                    return response.json()
+
+            HF_STATS.record_retry()
+            time.sleep(retry_delay(response, attempt))
 
 #simplifying the caption by removing common words.
+#picks the longest noun (the later one on ties), results are memoized since batches and captions repeat a lot.
+@functools.lru_cache(maxsize=4096)
+@traced('tagging', record_file=False)
 def simplify_caption(caption: str) -> str:
+    word_tokenize = load_nltk()
     tokens = word_tokenize(caption)
-    tagged_words = pos_tag(tokens)
+    tagged_words = get_tagger().tag(tokens)
     
     nouns = [word for word, pos in tagged_words if pos in ('NN', 'NNS', 'NNP', 'NNPS')]
     
     if not nouns:
         return sanitize_folder_name(tokens[0]) if tokens else "Untitled"
     
-    ranked_nouns = sorted(nouns, key=lambda word: (len(word), tokens.index(word)), reverse=True)
+    first_index = {}
+    for index, token in enumerate(tokens):
+        first_index.setdefault(token, index)
     
-    most_meaningful_word = ranked_nouns[0]
+    most_meaningful_word = max(nouns, key=lambda word: (len(word), first_index[word]))
     
     simplified_word = re.sub(r'[^a-zA-Z0-9]', '', most_meaningful_word)
     if simplified_word.endswith('s') and len(simplified_word) > 3:
@@ -252,219 +1286,1443 @@ def sanitize_folder_name(folder_name: str) -> str:
     sanitized_name = re.sub(r'[<>:"/\\|?*\n]', '', folder_name)
     return sanitized_name.strip()[:50]
 
-#gets the topic of a pdf file.
-def get_pdf_topic(pdf_path: str, groq_client: Groq) -> str:
-    with open(pdf_path, 'rb') as file:
-        reader = PyPDF2.PdfReader(file)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text()
-    
-    chat_completion = groq_client.chat.completions.create(
-        messages=[
-            {
-                "role": "system",
-                "content": "You are a helpful assistant that summarizes documents and provides a single-word topic."
-            },
-            {
-                "role": "user",
-                "content": f"Summarize this text and provide a single-word topic: {text[:1000]}"
-            }
-        ],
-        model="llama3-8b-8192",
-        max_tokens=50
+#prompts used to get a single-word topic for each kind of document, {excerpt} is the text or the column names of the file.
+TOPIC_PROMPTS = {
+    'pdf': (
+        "You are a helpful assistant that summarizes documents and provides a single-word topic.",
+        "Summarize this text and provide a single-word topic: {excerpt}"
+    ),
+    'excel': (
+        "You are a helpful assistant that analyzes Excel files and provides a single-word topic.",
+        "Analyze these Excel column names and provide a single-word topic: {excerpt}"
+    ),
+    'csv': (
+        "You are a helpful assistant that analyzes CSV files and provides a single-word topic.",
+        "Analyze these CSV column names and provide a single-word topic: {excerpt}"
+    ),
+    'doc': (
+        "You are a helpful assistant that summarizes documents and provides a single-word topic.",
+        "Summarize this text and provide a single-word topic: {excerpt}"
     )
+}
 
-    summary = chat_completion.choices[0].message.content.strip()
-    folder_name = simplify_caption(summary)    
-    return sanitize_folder_name(folder_name)
+#turns the model's answer into a folder name, excel topics were never simplified so they keep their exact wording.
+def finish_topic(kind: str, topic: str) -> str:
+    if kind == 'excel':
+        return sanitize_folder_name(topic)
+    return sanitize_folder_name(simplify_caption(topic))
 
-#gets the topic of an excel file.
-def get_excel_topic(excel_path: str, groq_client: Groq) -> str:
-    df = pd.read_excel(excel_path)
-    column_names = ", ".join(df.columns)
-    
-    chat_completion = groq_client.chat.completions.create(
+#asks groq for the topic of a single document excerpt.
+def classify_excerpt(kind: str, excerpt: str, groq_client: Groq) -> str:
+    system_prompt, user_prompt = TOPIC_PROMPTS[kind]
+    topic = groq_chat(
+        groq_client,
         messages=[
             {
                 "role": "system",
-                "content": "You are a helpful assistant that analyzes Excel files and provides a single-word topic."
+                "content": system_prompt
             },
             {
                 "role": "user",
-                "content": f"Analyze these Excel column names and provide a single-word topic: {column_names}"
+                "content": user_prompt.format(excerpt=excerpt)
             }
         ],
-        model="llama3-8b-8192",
+        model=TOPIC_MODEL,
         max_tokens=50
     )
-    
-    topic = chat_completion.choices[0].message.content.strip()
-    return sanitize_folder_name(topic)
+    return finish_topic(kind, topic)
 
-#gets the topic of a csv file.
-def get_csv_topic(csv_path: str, groq_client: Groq) -> str:
-    encodings = ['utf-8', 'iso-8859-1', 'windows-1252']
-    
+#how much of a document is read to classify it, topics only ever look at the first EXCERPT_CHARS characters.
+EXCERPT_CHARS = 1000
+#per-file budget for pdf text extraction, scanned reports stop after this many pages or seconds.
+PDF_MAX_PAGES = 20
+PDF_TIME_BUDGET = 5.0
+
+#checks whether a pdf page can contain text, pages without any font resource are scanned images and are skipped
+#without running the (slow) text extraction on them.
+def pdf_page_has_text(page) -> bool:
+    try:
+        resources = page.get('/Resources')
+        resources = resources.get_object() if resources is not None else None
+        if resources is None:
+            return True
+        if '/Font' in resources:
+            return True
+        xobjects = resources.get('/XObject')
+        if xobjects is None:
+            return False
+        #text can also live inside form xobjects, only plain image pages are skipped
+        for xobject in xobjects.get_object().values():
+            if xobject.get_object().get('/Subtype') == '/Form':
+                return True
+        return False
+    except Exception:
+        return True
+
+#extracts the first EXCERPT_CHARS characters of text from a pdf file.
+#pages are read lazily and extraction stops as soon as there is enough text or the page/time budget runs out,
+#so big scanned reports cost the same as a one page pdf.
+@traced('extract.pdf')
+def extract_pdf_text(pdf_path: str) -> str:
+    deadline = time.monotonic() + PDF_TIME_BUDGET
+    parts = []
+    collected = 0
+    import PyPDF2
+
+    with open(pdf_path, 'rb') as file:
+        reader = PyPDF2.PdfReader(file, strict=False)
+        for page_number in range(min(len(reader.pages), PDF_MAX_PAGES)):
+            page = reader.pages[page_number]
+            if pdf_page_has_text(page):
+                page_text = page.extract_text() or ""
+                parts.append(page_text[:EXCERPT_CHARS - collected])
+                collected += len(parts[-1])
+            if collected >= EXCERPT_CHARS or time.monotonic() > deadline:
+                break
+    return "".join(parts)
+
+#reads the header row of every sheet in an excel workbook without loading the sheets themselves.
+#xlsx files are streamed with openpyxl's read-only reader, old xls files are opened on demand one sheet at a time.
+def read_excel_headers(excel_path: str):
+    headers = []
+    if excel_path.lower().endswith('.xls'):
+        import xlrd
+        book = xlrd.open_workbook(excel_path, on_demand=True)
+        try:
+            for index in range(book.nsheets):
+                sheet = book.sheet_by_index(index)
+                row = sheet.row_values(0) if sheet.nrows else []
+                headers.append((sheet.name, row))
+                book.unload_sheet(index)
+        finally:
+            book.release_resources()
+    else:
+        import openpyxl
+        workbook = openpyxl.load_workbook(excel_path, read_only=True, data_only=True)
+        try:
+            for worksheet in workbook.worksheets:
+                row = next(worksheet.iter_rows(max_row=1, values_only=True), ())
+                headers.append((worksheet.title, row))
+        finally:
+            workbook.close()
+    return [
+        (sheet_name, [str(cell).strip() for cell in row if cell is not None and str(cell).strip()])
+        for sheet_name, row in headers
+    ]
+
+#extracts the column names of an excel file, workbooks with several sheets list the columns of each sheet.
+@traced('extract.excel')
+def extract_excel_columns(excel_path: str) -> str:
+    sheets = [(sheet_name, columns) for sheet_name, columns in read_excel_headers(excel_path) if columns]
+    if len(sheets) == 1:
+        return ", ".join(sheets[0][1])
+    return "; ".join(f"{sheet_name}: {', '.join(columns)}" for sheet_name, columns in sheets)
+
+#csv headers are read from a single sample of this many bytes, whatever the size of the file.
+CSV_SAMPLE_BYTES = 64 * 1024
+
+#decodes a csv sample with the first encoding that fits, a sample cut off mid-file is trimmed to its last full line first.
+def decode_csv_sample(sample: bytes, truncated: bool):
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return sample[:len(sample) - len(sample) % 2].decode('utf-16', errors='ignore')
+    if truncated and b'\n' in sample:
+        sample = sample[:sample.rindex(b'\n') + 1]
+
+    encodings = ['utf-8-sig', 'windows-1252', 'iso-8859-1']
     for encoding in encodings:
         try:
-            with open(csv_path, 'r', newline='', encoding=encoding) as file:
-                csv_reader = csv.reader(file)
-                headers = next(csv_reader, None)
-            
-            if headers:
-                column_names = ", ".join(headers)
-                break
+            return sample.decode(encoding)
         except UnicodeDecodeError:
             continue
+    return None
+
+#extracts the column names of a csv file, returns None when the header can't be read with any of the usual encodings.
+#the encoding and the delimiter are both detected from one small sample at the start of the file.
+@traced('extract.csv')
+def extract_csv_columns(csv_path: str):
+    with open(csv_path, 'rb') as file:
+        sample = file.read(CSV_SAMPLE_BYTES)
+        truncated = len(sample) == CSV_SAMPLE_BYTES
+
+    text = decode_csv_sample(sample, truncated)
+    if not text:
+        return None
+
+    try:
+        dialect = csv.Sniffer().sniff(text[:8192], delimiters=',;\t|')
+    except csv.Error:
+        dialect = csv.excel
+    headers = next(csv.reader(StringIO(text, newline=''), dialect), None)
+    if headers:
+        return ", ".join(headers)
+    return None
+
+#text each wordprocessingml run element stands for, matched by local name so strict ooxml files work too.
+DOCX_RUN_TEXT = {'tab': '\t', 'cr': '\n', 'noBreakHyphen': '-'}
+
+#finds the main part of a docx package, it's word/document.xml unless the package relationships say otherwise.
+def docx_document_part(archive) -> str:
+    if 'word/document.xml' in archive.namelist():
+        return 'word/document.xml'
+    from xml.etree import ElementTree
+    with archive.open('_rels/.rels') as rels:
+        for relationship in ElementTree.parse(rels).getroot():
+            if relationship.get('Type', '').endswith('/officeDocument'):
+                return relationship.get('Target', '').lstrip('/')
+    raise ValueError("No document part in the docx file")
+
+#streams the text of a docx file out of its zip with an incremental xml parser and stops after limit characters.
+#like python-docx's document.paragraphs only the paragraphs of the body are read (no tables or text boxes), and every
+#finished paragraph is dropped from the tree, so a docx costs a few milliseconds and constant memory whatever its size.
+def read_docx_text(file_path: str, limit: int = EXCERPT_CHARS) -> str:
+    import zipfile
+    from xml.etree import ElementTree
+
+    paragraphs = []
+    runs = []
+    collected = 0
+    path = []
+    body = None
+    with zipfile.ZipFile(file_path) as archive, archive.open(docx_document_part(archive)) as part:
+        for event, element in ElementTree.iterparse(part, events=('start', 'end')):
+            name = element.tag.rpartition('}')[2]
+            if event == 'start':
+                path.append(name)
+                if path == ['document', 'body']:
+                    body = element
+                continue
+            path.pop()
+            if len(path) == 2 and path[1] == 'body':
+                if name == 'p':
+                    paragraphs.append("".join(runs))
+                    collected += len(paragraphs[-1]) + 1
+                runs = []
+                body.clear()
+                if collected > limit:
+                    break
+            elif path[-1:] == ['r'] and path[1:3] == ['body', 'p'] and 'p' not in path[3:]:
+                if name == 't':
+                    runs.append(element.text or "")
+                elif name == 'br':
+                    #page and column breaks carry no text, only plain line breaks do
+                    if element.get(element.tag[:-len(name)] + 'type', 'textWrapping') == 'textWrapping':
+                        runs.append("\n")
+                elif name in DOCX_RUN_TEXT:
+                    runs.append(DOCX_RUN_TEXT[name])
+    return "\n".join(paragraphs)[:limit]
+
+#word 97-2003 control characters: field codes (between 0x13 and 0x14) are dropped and only their results are kept,
+#paragraph, cell and page marks become line breaks or tabs.
+WORD_FIELD_CODE = re.compile(r'\x13[^\x13\x14\x15]*(?:\x14|(?=\x15))')
+WORD_CONTROL_CHARS = str.maketrans({'\r': '\n', '\x07': '\t', '\x0b': '\n', '\x0c': '\n', '\x1e': '-', '\x15': None, '\x1f': None})
+WORD_LEFTOVER_CHARS = re.compile(r'[\x00-\x08\x0e-\x1f]')
+
+#reads the main text of a word 97-2003 .doc file straight from its piece table, without word or any other process.
+#the ole container is opened with olefile, the fib gives where the piece table is and how long the main text is, and
+#only the pieces covering the first limit characters are decoded (8-bit cp1252 or utf-16, as each piece says).
+def read_legacy_doc_text(file_path: str, limit: int = EXCERPT_CHARS) -> str:
+    import olefile
+
+    with olefile.OleFileIO(file_path) as ole:
+        word_document = ole.openstream('WordDocument').read()
+        ident = struct.unpack_from('<H', word_document, 0)[0]
+        #fibbase flags, after wIdent, nFib, unused, lid and pnNext (fEncrypted is 0x0100, fWhichTblStm 0x0200)
+        flags = struct.unpack_from('<H', word_document, 0x0A)[0]
+        if ident != 0xA5EC:
+            raise ValueError("Not a Word 97-2003 document")
+        if flags & 0x0100:
+            raise ValueError("The document is encrypted")
+        main_text_length = struct.unpack_from('<i', word_document, 0x4C)[0]
+        clx_offset, clx_length = struct.unpack_from('<II', word_document, 0x01A2)
+        table_stream = '1Table' if flags & 0x0200 else '0Table'
+        clx = ole.openstream(table_stream).read()[clx_offset:clx_offset + clx_length]
+
+    #the clx starts with optional property modifiers (0x01), then the piece table (0x02)
+    position = 0
+    while position < len(clx) and clx[position] == 0x01:
+        position += 3 + struct.unpack_from('<H', clx, position + 1)[0]
+    if position >= len(clx) or clx[position] != 0x02:
+        raise ValueError("No piece table in the document")
+    table_length = struct.unpack_from('<I', clx, position + 1)[0]
+    pieces = (table_length - 4) // 12
+    table_start = position + 5
+    positions = struct.unpack_from(f'<{pieces + 1}I', clx, table_start)
+
+    wanted = min(main_text_length, limit * 2)
+    parts = []
+    for index in range(pieces):
+        if positions[index] >= wanted:
+            break
+        count = min(positions[index + 1], wanted) - positions[index]
+        offset = struct.unpack_from('<I', clx, table_start + (pieces + 1) * 4 + index * 8 + 2)[0]
+        if offset & 0x40000000:
+            offset = (offset & 0x3FFFFFFF) // 2
+            parts.append(word_document[offset:offset + count].decode('cp1252', errors='replace'))
+        else:
+            parts.append(word_document[offset:offset + count * 2].decode('utf-16-le', errors='replace'))
+    text = WORD_FIELD_CODE.sub('', "".join(parts)).translate(WORD_CONTROL_CHARS)
+    return WORD_LEFTOVER_CHARS.sub('', text)[:limit]
+
+#reads a .doc file through word itself over com, only used on windows for files the piece table reader can't handle
+#(word 95 and older, encrypted or damaged documents).
+def read_doc_with_word(file_path: str) -> str:
+    import pythoncom
+    import win32com.client
+    pythoncom.CoInitialize()
+    try:
+        word = win32com.client.Dispatch("Word.Application")
+        word.Visible = False
+        try:
+            doc = word.Documents.Open(file_path)
+            text = doc.Content.Text
+        finally:
+            doc.Close()
+            word.Quit()
+    finally:
+        pythoncom.CoUninitialize()
+    return text
+
+#extracts the first EXCERPT_CHARS characters of text from a doc/docx file.
+@traced('extract.doc')
+def extract_doc_text(file_path: str) -> str:
+    if file_path.lower().endswith('.docx'):
+        return read_docx_text(file_path)
+    elif file_path.lower().endswith('.doc'):
+        try:
+            return read_legacy_doc_text(file_path)
+        except (ValueError, OSError, struct.error):
+            if os.name != 'nt':
+                raise
+        return read_doc_with_word(file_path)[:EXCERPT_CHARS]
     else:
+        raise ValueError("Unsupported file format")
+
+#gets the topic of a pdf file.
+def get_pdf_topic(pdf_path: str, groq_client: Groq) -> str:
+    return classify_document('pdf', extract_pdf_text(pdf_path), groq_client)
+
+#gets the topic of an excel file.
+def get_excel_topic(excel_path: str, groq_client: Groq) -> str:
+    return classify_document('excel', extract_excel_columns(excel_path), groq_client)
+
+#gets the topic of a csv file.
+def get_csv_topic(csv_path: str, groq_client: Groq) -> str:
+    column_names = extract_csv_columns(csv_path)
+    if column_names is None:
         return "Untitled_CSV"
-    
-    chat_completion = groq_client.chat.completions.create(
-        messages=[
-            {
-                "role": "system",
-                "content": "You are a helpful assistant that analyzes CSV files and provides a single-word topic."
-            },
-            {
-                "role": "user",
-                "content": f"Analyze these CSV column names and provide a single-word topic: {column_names}"
-            }
-        ],
-        model="llama3-8b-8192",
-        max_tokens=50
-    )
-    
-    topic = chat_completion.choices[0].message.content.strip()
-    simplified_topic = simplify_caption(topic)
-    return sanitize_folder_name(simplified_topic)
+    return classify_document('csv', column_names, groq_client)
 
-#organizes a folder by moving files to appropriate folders based on their content.
-def organize_folder(folder_path: str, groq_client: Groq, hf_headers):
-    
-    print("Initializing Natural Language Toolkit...")
-    silent_nltk_download('punkt')
-    silent_nltk_download('averaged_perceptron_tagger')
-    print("Running organize...")
+#gets the topic of a doc/docx file.
+def get_doc_topic(file_path: str, groq_client: Groq) -> str:
+    return classify_document('doc', extract_doc_text(file_path), groq_client)
 
-    if not os.path.exists(folder_path):
-        print(f"Folder not found: {folder_path}")
-        return
+#number of documents packed into one groq request by organize, can be changed with --batch=N (--batch=1 turns batching off).
+BATCH_SIZE = 8
 
-    categories = ['images', 'pdfs', 'excels', 'csvs', 'docs', 'other_files']
-    for category in categories:
-        os.makedirs(os.path.join(folder_path, category), exist_ok=True)
-
-    for filename in os.listdir(folder_path):
-        file_path = os.path.join(folder_path, filename)
-        if os.path.isfile(file_path):
-            file_extension = os.path.splitext(filename)[1].lower()
-
-            if file_extension in ('.png', '.jpg', '.jpeg', '.gif'):
-                process_image(file_path, folder_path, hf_headers)
-            elif file_extension == '.pdf':
-                process_pdf(file_path, folder_path, groq_client)
-            elif file_extension in ('.xls', '.xlsx'):
-                process_excel(file_path, folder_path, groq_client)
-            elif file_extension == '.csv':
-                process_csv(file_path, folder_path, groq_client)
-            elif file_extension in ('.doc', '.docx'):
-                process_doc_docx(file_path, folder_path, groq_client)
-            else:
-                move_to_other_files(file_path, folder_path)
+#how each kind of excerpt is described to the model in a batch request.
+EXCERPT_LABELS = {
+    'pdf': 'PDF text',
+    'excel': 'Excel column names',
+    'csv': 'CSV column names',
+    'doc': 'Word document text'
+}
 
-#processes a doc/docx file.
-def process_doc_docx(file_path: str, base_folder: str, groq_client: Groq):
-    try:
-        if file_path.lower().endswith('.docx'):
-            doc = docx.Document(file_path)
-            text = '\n'.join([paragraph.text for paragraph in doc.paragraphs])
-        elif file_path.lower().endswith('.doc'):
-            pythoncom.CoInitialize()
-            word = win32com.client.Dispatch("Word.Application")
-            word.Visible = False
-            try:
-                doc = word.Documents.Open(file_path)
-                text = doc.Content.Text
-            finally:
-                doc.Close()
-                word.Quit()
-        else:
-            raise ValueError("Unsupported file format")
+#classifies several documents with a single groq request, items are (file id, kind, excerpt) tuples.
+#returns {file id: folder name} for the files the model answered properly, the caller classifies the rest one by one.
+def classify_batch(items, groq_client: Groq) -> dict:
+    if len(items) < 2:
+        return {}
 
-        chat_completion = groq_client.chat.completions.create(
+    listing = "\n\n".join(
+        f"File {file_id} ({EXCERPT_LABELS[kind]}): {excerpt}"
+        for file_id, kind, excerpt in items
+    )
+    try:
+        response = groq_chat(
+            groq_client,
             messages=[
                 {
                     "role": "system",
-                    "content": "You are a helpful assistant that summarizes documents and provides a single-word topic."
+                    "content": "You are a helpful assistant that classifies files and provides a single-word topic for each one. Answer with a JSON object that maps every file id to its topic."
                 },
                 {
                     "role": "user",
-                    "content": f"Summarize this text and provide a single-word topic: {text[:1000]}"
+                    "content": f"Provide a single-word topic for each of these files:\n\n{listing}"
                 }
             ],
-            model="llama3-8b-8192",
-            max_tokens=50
+            model=TOPIC_MODEL,
+            max_tokens=20 * len(items) + 50,
+            response_format={"type": "json_object"}
         )
-
-        topic = chat_completion.choices[0].message.content.strip()
-        simplified_topic = simplify_caption(topic)
-        category_folder = os.path.join(base_folder, 'docs', simplified_topic)
-        os.makedirs(category_folder, exist_ok=True)
-        new_file_path = os.path.join(category_folder, os.path.basename(file_path))
-        os.rename(file_path, new_file_path)
-        print(f"Moved {os.path.basename(file_path)} to docs/{simplified_topic} folder")
     except Exception as e:
-        print(f"Error processing document {os.path.basename(file_path)}: {str(e)}")
-    finally:
-        pythoncom.CoUninitialize()
+        print(f"Batch classification failed, classifying {len(items)} files one by one: {str(e)}")
+        return {}
+    return parse_batch_topics(response, items)
 
-#processes a csv file.
-def process_csv(file_path: str, base_folder: str, groq_client: Groq):
+#parses the JSON answer of a batch request, ids that are missing or don't map to a usable topic are left out.
+def parse_batch_topics(response: str, items) -> dict:
+    start, end = response.find('{'), response.rfind('}')
     try:
-        topic = get_csv_topic(file_path, groq_client)
-        category_folder = os.path.join(base_folder, 'csvs', topic)
-        os.makedirs(category_folder, exist_ok=True)
-        new_file_path = os.path.join(category_folder, os.path.basename(file_path))
-        os.rename(file_path, new_file_path)
+        answer = json.loads(response[start:end + 1]) if start != -1 else None
+    except ValueError:
+        answer = None
+    if not isinstance(answer, dict):
+        return {}
+
+    topics = {}
+    for file_id, kind, excerpt in items:
+        topic = answer.get(file_id)
+        if isinstance(topic, str) and topic.strip():
+            topic = finish_topic(kind, topic)
+            if topic:
+                topics[file_id] = topic
+    return topics
+
+#classification backends turn document excerpts into folder names, organize uses whichever one is in CLASSIFIER.
+#classify returns (folder name, confidence) and classify_many returns {file id: folder name} for (file id, kind, excerpt) items,
+#leaving out the files it couldn't classify. model identifies the backend in topic cache keys.
+class ClassifierBackend(ABC):
+    model = ""
+
+    @abstractmethod
+    def classify(self, kind: str, excerpt: str, groq_client: Groq):
+        pass
+
+    def classify_many(self, items, groq_client: Groq) -> dict:
+        topics = {}
+        for file_id, kind, excerpt in items:
+            topic, _ = self.classify(kind, excerpt, groq_client)
+            if topic:
+                topics[file_id] = topic
+        return topics
+
+#the original backend, every document is classified by the llm on groq.
+class RemoteBackend(ClassifierBackend):
+    model = TOPIC_MODEL
+
+    def classify(self, kind: str, excerpt: str, groq_client: Groq):
+        return classify_excerpt(kind, excerpt, groq_client), 1.0
+
+    def classify_many(self, items, groq_client: Groq) -> dict:
+        return classify_batch(items, groq_client)
+
+#the local model hashes words into this many features, it keeps the model small whatever the vocabulary.
+LOCAL_MODEL_FEATURES = 2 ** 15
+LOCAL_MODEL_FILE = os.path.join(os.path.expanduser("~"), ".fastfox", "local_model.npz")
+#local answers below this cosine similarity are sent to the llm instead, can be changed with --confidence=X
+LOCAL_CONFIDENCE = 0.35
+#the category folders the local model is trained on, with the kind of document they hold.
+TRAINING_CATEGORIES = {'pdfs': 'pdf', 'excels': 'excel', 'csvs': 'csv', 'docs': 'doc'}
+
+#splits an excerpt into lowercase words, column names like invoiceDate or unit_price are split too.
+def excerpt_words(excerpt: str):
+    excerpt = re.sub(r'([a-z])([A-Z])', r'\1 \2', excerpt)
+    return [word for word in re.findall(r'[a-z0-9]+', excerpt.lower()) if not word.isdigit()]
+
+#hashes the words of an excerpt into feature ids, returns the unique ids and their sublinear term frequencies.
+def hash_features(excerpt: str):
+    import numpy as np
+
+    words = excerpt_words(excerpt)
+    if not words:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    hashes = np.fromiter((zlib.crc32(word.encode('utf-8')) for word in words), dtype=np.int64, count=len(words))
+    features, counts = np.unique(hashes % LOCAL_MODEL_FEATURES, return_counts=True)
+    return features, (1 + np.log(counts)).astype(np.float32)
+
+#offline backend: a tf-idf nearest-centroid model over hashed words, trained on folders fastfox already organized.
+#classifying is a sparse dot product against one centroid per topic, so it needs no network at all.
+class LocalBackend(ClassifierBackend):
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.models = None
+        self.idf = None
+        self.model = "local-" + file_digest(path)[:12]
+
+    def load(self):
+        if self.models is None:
+            with self.lock:
+                if self.models is None:
+                    import numpy as np
+                    with np.load(self.path, allow_pickle=False) as data:
+                        self.idf = data['idf']
+                        self.models = {
+                            kind: (data[f'labels_{kind}'], data[f'centroids_{kind}'])
+                            for kind in TRAINING_CATEGORIES.values() if f'labels_{kind}' in data
+                        }
+        return self.models
+
+    def classify(self, kind: str, excerpt: str, groq_client: Groq = None):
+        import numpy as np
+
+        model = self.load().get(kind)
+        features, frequencies = hash_features(excerpt)
+        if model is None or not len(features):
+            return None, 0.0
+        labels, centroids = model
+        weights = frequencies * self.idf[features]
+        norm = np.linalg.norm(weights)
+        if not norm:
+            return None, 0.0
+        scores = centroids[:, features] @ (weights / norm)
+        best = int(np.argmax(scores))
+        if scores[best] <= 0:
+            return None, 0.0
+        return str(labels[best]), float(scores[best])
+
+#the local model answers first and the llm only sees the documents it isn't confident about.
+class CascadeBackend(ClassifierBackend):
+    def __init__(self, local: LocalBackend, remote: RemoteBackend, threshold: float):
+        self.local = local
+        self.remote = remote
+        self.threshold = threshold
+        self.model = f"{local.model}+{remote.model}@{threshold}"
+        self.stats_lock = threading.Lock()
+        self.local_answers = 0
+        self.remote_answers = 0
+
+    def count(self, local: bool):
+        with self.stats_lock:
+            if local:
+                self.local_answers += 1
+            else:
+                self.remote_answers += 1
+
+    def classify(self, kind: str, excerpt: str, groq_client: Groq):
+        topic, confidence = self.local.classify(kind, excerpt)
+        if topic and confidence >= self.threshold:
+            self.count(True)
+            return topic, confidence
+        self.count(False)
+        return self.remote.classify(kind, excerpt, groq_client)
+
+    def classify_many(self, items, groq_client: Groq) -> dict:
+        topics = {}
+        uncertain = []
+        for file_id, kind, excerpt in items:
+            topic, confidence = self.local.classify(kind, excerpt)
+            if topic and confidence >= self.threshold:
+                self.count(True)
+                topics[file_id] = topic
+            else:
+                uncertain.append((file_id, kind, excerpt))
+        if uncertain:
+            remote_topics = self.remote.classify_many(uncertain, groq_client)
+            for _ in remote_topics:
+                self.count(False)
+            topics.update(remote_topics)
+        return topics
+
+    def describe(self) -> str:
+        return f"Local classifier: {self.local_answers} files classified locally, {self.remote_answers} sent to Groq"
+
+CLASSIFIER = RemoteBackend()
+
+#picks the backend for --backend=remote|local|auto, auto uses the local model with the llm as fallback once one is trained.
+def select_backend(name: str, threshold: float = LOCAL_CONFIDENCE):
+    remote = RemoteBackend()
+    if name == 'remote':
+        return remote
+    if not os.path.exists(LOCAL_MODEL_FILE):
+        if name == 'local':
+            print("No local model found, run `fastfox train <organized folder>` first. Using Groq instead.")
+        return remote
+    local = LocalBackend(LOCAL_MODEL_FILE)
+    if name == 'local':
+        return local
+    return CascadeBackend(local, remote, threshold)
+
+#classifies a document excerpt with the active backend.
+def classify_document(kind: str, excerpt: str, groq_client: Groq) -> str:
+    topic, _ = CLASSIFIER.classify(kind, excerpt, groq_client)
+    return topic or "Untitled"
+
+#bytes hashed at the start and at the end of a file to tell apart same-sized files before hashing them completely.
+PARTIAL_HASH_BYTES = 64 * 1024
+
+#hash of the first and last PARTIAL_HASH_BYTES of a file, for files up to twice that size it covers the whole content.
+def partial_digest(file_path: str, size: int) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        digest.update(f.read(PARTIAL_HASH_BYTES))
+        if size > 2 * PARTIAL_HASH_BYTES:
+            f.seek(size - PARTIAL_HASH_BYTES)
+        digest.update(f.read(PARTIAL_HASH_BYTES))
+    return digest.hexdigest()
+
+#groups files with exactly the same content and returns {first file: [its copies]}, files are the entries of scan_files.
+#files are bucketed by size, then by a partial hash and only then by a full hash, so a file with a unique size is never read
+#and every hash is computed in chunks, whatever the size of the files. files are read from the scan as they come, only a
+#path is kept per file (a list only for sizes shared by several files), so memory stays small on huge folders.
+#only files of the same kind (or extension, for files organize doesn't classify) are copies, since a copy is filed with its
+#original. empty files are all alike and are never grouped.
+def find_duplicates(files) -> dict:
+    first_of_size, by_size = {}, {}
+    for entry in files:
+        try:
+            size = entry.stat().st_size
+        except OSError:
+            continue
+        if size:
+            key = (file_kind(entry.path) or os.path.splitext(entry.path)[1].lower(), size)
+            if key in by_size:
+                by_size[key].append(entry.path)
+            elif key in first_of_size:
+                by_size[key] = [first_of_size.pop(key), entry.path]
+            else:
+                first_of_size[key] = entry.path
+    del first_of_size
+
+    groups = {}
+    for (_, size), same_size in by_size.items():
+        by_partial = {}
+        for file_path in same_size:
+            try:
+                by_partial.setdefault(partial_digest(file_path, size), []).append(file_path)
+            except OSError:
+                continue
+        for candidates in by_partial.values():
+            if len(candidates) < 2:
+                continue
+            if size > 2 * PARTIAL_HASH_BYTES:
+                by_digest = {}
+                for file_path in candidates:
+                    try:
+                        by_digest.setdefault(file_digest(file_path), []).append(file_path)
+                    except OSError:
+                        continue
+                candidate_groups = by_digest.values()
+            else:
+                candidate_groups = [candidates]
+            for group in candidate_groups:
+                if len(group) > 1:
+                    groups[group[0]] = group[1:]
+    return groups
+
+#number of minhash values per document and how they're split into bands for the lookup.
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16
+#documents whose excerpts are at least this similar (estimated jaccard similarity of their word 3-grams) share a topic.
+NEAR_DUPLICATE_SIMILARITY = 0.8
+MINHASH_PRIME = (1 << 61) - 1
+MINHASH_SEEDS = [(seed.randrange(1, MINHASH_PRIME), seed.randrange(MINHASH_PRIME)) for seed in [random.Random(20)] for _ in range(MINHASH_PERMUTATIONS)]
+
+#minhash signature of a text's word 3-grams.
+def minhash_signature(text: str) -> tuple:
+    words = re.findall(r'\w+', text.lower())
+    shingles = {zlib.crc32(" ".join(words[i:i + 3]).encode('utf-8')) for i in range(max(1, len(words) - 2))}
+    return tuple(min((a * shingle + b) % MINHASH_PRIME for shingle in shingles) for a, b in MINHASH_SEEDS)
+
+#finds documents whose excerpts are near-duplicates of an earlier one (re-saves, other versions of the same report),
+#those follow the topic of the first one instead of being classified. signatures are bucketed per band (LSH),
+#so each lookup only compares against documents that share at least one band.
+class NearDuplicateIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.signatures = {}
+        self.followers = {}
+
+    #returns True when file_path is a near-duplicate of an indexed document, otherwise indexes it.
+    #the signature can be passed in when it was already computed (organize does that in its extraction workers).
+    def add(self, file_path: str, kind: str, excerpt: str, signature: tuple = None) -> bool:
+        if signature is None:
+            signature = minhash_signature(excerpt)
+        rows = MINHASH_PERMUTATIONS // MINHASH_BANDS
+        bands = [(kind, band, signature[band * rows:(band + 1) * rows]) for band in range(MINHASH_BANDS)]
+        with self.lock:
+            candidates = {leader for band in bands for leader in self.buckets.get(band, ())}
+            for leader in sorted(candidates):
+                matches = sum(x == y for x, y in zip(signature, self.signatures[leader]))
+                if matches >= NEAR_DUPLICATE_SIMILARITY * MINHASH_PERMUTATIONS:
+                    self.followers.setdefault(leader, []).append(file_path)
+                    return True
+            self.signatures[file_path] = signature
+            for band in bands:
+                self.buckets.setdefault(band, []).append(file_path)
+        return False
+
+#plans every copy with the category and topic of the file it copies, copies of a file that couldn't be classified are left
+#for the next run. returns the number of copies planned.
+def plan_copies(groups: dict, journal) -> int:
+    planned = 0
+    for original, copies in groups.items():
+        target = journal.planned.get(original)
+        if target is None:
+            continue
+        for file_path in copies:
+            journal.plan(file_path, *target)
+            planned += 1
+    return planned
+
+#keeps only the files the quota left in the ledger can classify, documents cost a groq request per batch and images a
+#hugging face request each (files already in the topic cache cost nothing, so this errs on the safe side).
+#the other files stay in the folder for the next run. files are passed through lazily, as the scan finds them.
+def fit_quota(files, batch_size: int):
+    is_image = lambda file_path: os.path.splitext(file_path)[1].lower() in ('.png', '.jpg', '.jpeg', '.gif')
+    is_document = lambda file_path: os.path.splitext(file_path)[1].lower() in DOCUMENT_KINDS
+
+    documents_left = sys.maxsize
+    if not isinstance(CLASSIFIER, LocalBackend):
+        documents_left = QUOTA.remaining('groq', TOPIC_MODEL) * max(1, batch_size)
+    images_left = QUOTA.remaining('hf', CAPTION_MODEL)
+
+    kept, skipped = 0, 0
+    for file_path in files:
+        if is_document(file_path):
+            if documents_left <= 0:
+                skipped += 1
+                continue
+            documents_left -= 1
+        elif is_image(file_path):
+            if images_left <= 0:
+                skipped += 1
+                continue
+            images_left -= 1
+        kept += 1
+        yield file_path
+    if skipped:
+        print(f"The API quota left covers {kept} of {kept + skipped} files, the other {skipped} are left for the next run.")
+
+#folders organize sorts files into, scans never look inside them.
+CATEGORY_FOLDERS = ('images', 'pdfs', 'excels', 'csvs', 'docs', 'other_files')
+
+#checks a file or folder against a list of globs, matched against both its name and its path relative to the scanned folder.
+def matches_any(name: str, relative_path: str, patterns) -> bool:
+    return any(fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(relative_path, pattern) for pattern in patterns)
+
+#yields the os.DirEntry of every file in a folder, in the order the file system lists them.
+#entries come straight from os.scandir, so there's no extra stat call per file and their cached stat results are reused
+#later (find_duplicates). with recursive, subfolders are walked from a stack of folder paths with one folder open at a
+#time, so memory stays flat however many files there are. symlinked folders and the category folders organize writes to
+#are never walked. only files matching one of the include globs are yielded (all of them when there are none), and
+#files or folders matching an exclude glob are skipped, an excluded folder isn't walked at all.
+def scan_files(folder_path: str, recursive: bool = False, include=(), exclude=()):
+    root = os.path.abspath(folder_path)
+    folders = [root]
+    while folders:
+        folder = folders.pop()
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    relative_path = entry.path[len(root) + 1:]
+                    if exclude and matches_any(entry.name, relative_path, exclude):
+                        continue
+                    try:
+                        if entry.is_file():
+                            if not include or matches_any(entry.name, relative_path, include):
+                                yield entry
+                        elif recursive and entry.is_dir(follow_symlinks=False):
+                            if folder != root or entry.name not in CATEGORY_FOLDERS:
+                                folders.append(entry.path)
+                    except OSError:
+                        continue
+        except OSError as e:
+            if folder == root:
+                raise
+            print(f"Skipping {folder}: {str(e)}")
+
+JOBS_DIR = os.path.join(os.path.expanduser("~"), ".fastfox", "jobs")
+
+#journal of an organize run, one json line per event so it survives crashes and Ctrl+C:
+#  {"op": "plan", "file": ..., "category": ..., "topic": ...}  a file got classified (topic is null for other_files)
+#  {"op": "move", "file": ..., "to": ...}                       a planned file was moved
+#  {"op": "done"}                                                every planned file was moved
+#a rerun of an unfinished job only classifies the files that aren't planned yet, and a finished job can be undone.
+class OrganizeJournal:
+    def __init__(self, folder_path: str):
+        folder = os.path.normcase(os.path.abspath(folder_path))
+        self.path = os.path.join(JOBS_DIR, hashlib.sha1(folder.encode('utf-8')).hexdigest()[:16] + ".jsonl")
+        self.lock = threading.Lock()
+        self.planned = {}
+        self.moved = {}
+        self.finished = False
+        self.file = None
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry['op'] == 'plan':
+                        self.planned[entry['file']] = (entry['category'], entry['topic'])
+                    elif entry['op'] == 'move':
+                        self.moved[entry['file']] = entry['to']
+                    elif entry['op'] == 'done':
+                        self.finished = True
+        except FileNotFoundError:
+            pass
+
+    #opens the journal for writing, a finished job is replaced by a new one.
+    def start(self):
+        os.makedirs(JOBS_DIR, exist_ok=True)
+        if self.finished:
+            self.planned, self.moved, self.finished = {}, {}, False
+            self.file = open(self.path, 'w', encoding='utf-8')
+        else:
+            self.file = open(self.path, 'a', encoding='utf-8')
+
+    def record(self, entry: dict):
+        with self.lock:
+            self.file.write(json.dumps(entry) + "\n")
+            self.file.flush()
+
+    def plan(self, file_path: str, category: str, topic):
+        self.planned[file_path] = (category, topic)
+        self.record({'op': 'plan', 'file': file_path, 'category': category, 'topic': topic})
+
+    def unapplied(self):
+        return [(file_path, target) for file_path, target in self.planned.items() if file_path not in self.moved]
+
+    #prints what apply would do.
+    def show_plan(self):
+        for file_path, (category, topic) in self.unapplied():
+            destination = f"{category}/{topic}" if topic else category
+            print(f"Would move {os.path.basename(file_path)} to {destination} folder")
+
+    #does all the planned moves in one go.
+    def apply(self, base_folder: str):
+        for file_path, (category, topic) in self.unapplied():
+            check_cancelled()
+            if not os.path.exists(file_path):
+                print(f"Skipping {os.path.basename(file_path)}, it's no longer in the folder")
+                continue
+            target_folder = os.path.join(base_folder, category, topic) if topic else os.path.join(base_folder, category)
+            try:
+                new_file_path = move_file(file_path, target_folder)
+            except OSError as e:
+                print(f"Error moving {os.path.basename(file_path)}: {str(e)}")
+                continue
+            self.moved[file_path] = new_file_path
+            self.record({'op': 'move', 'file': file_path, 'to': new_file_path})
+            destination = f"{category}/{topic}" if topic else category
+            print(f"Moved {os.path.basename(file_path)} to {destination} folder")
+        self.record({'op': 'done'})
+        self.finished = True
+
+    #moves every file of the last job back where it was and removes the journal.
+    def undo(self):
+        restored = 0
+        for file_path, new_file_path in reversed(list(self.moved.items())):
+            if os.path.exists(new_file_path) and not os.path.exists(file_path):
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                os.rename(new_file_path, file_path)
+                restored += 1
+                topic_folder = os.path.dirname(new_file_path)
+                if os.path.basename(topic_folder) not in CATEGORY_FOLDERS:
+                    try:
+                        os.rmdir(topic_folder)
+                        CREATED_FOLDERS.discard(topic_folder)
+                    except OSError:
+                        pass
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        print(f"Moved {restored} files back to where they were.")
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+#processes that read the files for organize, so pdf parsing, spreadsheets and thumbnails use every core.
+#set it with --extract-workers=N, 0 reads the files on threads of the organize process instead (the default on a single core,
+#where extra processes only add their startup time).
+EXTRACT_WORKERS = os.cpu_count() if (os.cpu_count() or 1) > 1 else 0
+#extraction results waiting for the api stage, per api worker. once the queue is full the extraction workers pause,
+#and so does the scan.
+PIPELINE_QUEUE_PER_WORKER = 4
+
+#organizes a folder by moving files to appropriate folders based on their content.
+#files go through run_organize_pipeline: extract_workers processes read them and workers threads make the api calls,
+#the quota ledger keeps those inside the quotas. documents are classified batch_size at a time.
+#every classification is written to the job journal (plan), and the moves all happen at the end (apply),
+#so an interrupted run picks up where it stopped and --dry-run shows the plan without moving anything.
+#exact copies are found before anything is classified and only one file of each group is sent to the apis,
+#with near_duplicates documents with almost the same text also share one classification.
+#files stream from the scan through the pipeline with a bounded number of them in flight, only dedup needs the whole
+#listing (one entry per file) before the first file is classified. recursive, include and exclude are passed on to scan_files.
+def organize_folder(folder_path: str, groq_client: Groq, hf_headers, workers: int = DEFAULT_WORKERS, batch_size: int = BATCH_SIZE, dry_run: bool = False,
+                    dedup: bool = True, near_duplicates: bool = False, recursive: bool = False, include=(), exclude=(),
+                    extract_workers: int = EXTRACT_WORKERS):
+    import asyncio
+    
+    ensure_nltk_data()
+    print("Running organize...")
+
+    if not os.path.exists(folder_path):
+        print(f"Folder not found: {folder_path}")
+        return
+
+    journal = OrganizeJournal(folder_path)
+    if journal.planned and not journal.finished:
+        print(f"Resuming the previous organize run, {len(journal.planned)} files are already classified.")
+    journal.start()
+
+    #the folder is scanned again for the pipeline rather than keeping the dedup pass's entries, so files stream through
+    #organize with or without dedup
+    scan = lambda: (entry for entry in scan_files(folder_path, recursive, include, exclude) if entry.path not in journal.planned)
+    duplicates = find_duplicates(scan()) if dedup else {}
+    copies = {file_path for group in duplicates.values() for file_path in group}
+    if copies:
+        print(f"Found {len(copies)} copies of {len(duplicates)} files, each group is classified once.")
+    files = fit_quota((entry.path for entry in scan() if entry.path not in copies), batch_size)
+    similar = NearDuplicateIndex() if near_duplicates else None
+
+    try:
+        asyncio.run(run_organize_pipeline(files, groq_client, hf_headers, workers, batch_size, journal, similar, extract_workers))
+
+        if similar is not None and similar.followers:
+            print(f"Found {plan_copies(similar.followers, journal)} near-duplicate documents, they share the topic of their original.")
+        plan_copies(duplicates, journal)
+
+        if dry_run:
+            journal.show_plan()
+            print("Dry run, nothing was moved. Run organize again to apply this plan without classifying the files again.")
+        else:
+            for category in CATEGORY_FOLDERS:
+                os.makedirs(os.path.join(folder_path, category), exist_ok=True)
+            journal.apply(folder_path)
+    finally:
+        journal.close()
+
+    if HF_STATS.requests:
+        print(HF_STATS.describe("Hugging Face"))
+    if isinstance(CLASSIFIER, CascadeBackend):
+        print(CLASSIFIER.describe())
+
+#organize --undo: moves the files of the last organize run on this folder back.
+def undo_organize(folder_path: str):
+    journal = OrganizeJournal(folder_path)
+    if not journal.moved:
+        print(f"Nothing to undo for {folder_path}.")
+        return
+    journal.undo()
+
+#what organize classifies a file as: a DOCUMENT_KINDS kind, 'image', or None for files that go to other_files.
+def file_kind(file_path: str):
+    file_extension = os.path.splitext(file_path)[1].lower()
+    if file_extension in ('.png', '.jpg', '.jpeg', '.gif'):
+        return 'image'
+    return DOCUMENT_KINDS.get(file_extension)
+
+#category folder of a file kind.
+def kind_category(kind: str) -> str:
+    return 'images' if kind == 'image' else DOCUMENT_CATEGORIES[kind][0]
+
+#topic cache lookup before a file is read, returns the file's cache key and its topic if this content was classified before.
+def lookup_topic(file_path: str, kind: str):
+    if not TOPIC_CACHE.enabled:
+        return None, None
+    key = topic_cache_key(file_path, kind, CAPTION_MODEL if kind == 'image' else CLASSIFIER.model)
+    return key, TOPIC_CACHE.get(key)
+
+#first organize stage, reads from a file only what the api calls need. documents come back with their excerpt (and its
+#minhash signature when signature is set), images with their thumbnail and perceptual hash. errors are sent back as text.
+def extract_for_organize(file_path: str, kind: str, signature: bool) -> dict:
+    result = {'file': file_path, 'kind': kind}
+    try:
+        if kind == 'image':
+            result['thumbnail'], result['image_hash'] = prepare_image(file_path)
+        else:
+            result['excerpt'] = EXCERPT_EXTRACTORS[kind](file_path)
+            if signature and result['excerpt'] is not None:
+                result['signature'] = minhash_signature(result['excerpt'])
+    except Exception as e:
+        result['error'] = str(e)
+    return result
+
+#extract_for_organize in an extraction process, its spans go back with the result and end up in the organize tracer.
+def extract_in_worker(file_path: str, kind: str, signature: bool) -> dict:
+    global TRACER
+    TRACER = Tracer()
+    TRACER.spans = []
+    result = extract_for_organize(file_path, kind, signature)
+    result['spans'] = TRACER.spans
+    return result
+
+#extraction processes leave Ctrl+C to organize, which shuts them down itself.
+def init_extract_worker():
+    import signal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+#starts the extraction pool and returns it with the function to run on it. the processes are spawned rather than forked
+#since organize can run inside the threaded server, and threads are used where processes can't be started.
+def start_extract_pool(extract_workers: int):
+    if extract_workers > 0:
+        try:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            context = multiprocessing.get_context('spawn')
+            return ProcessPoolExecutor(max_workers=extract_workers, mp_context=context, initializer=init_extract_worker), extract_in_worker
+        except (ImportError, OSError, NotImplementedError) as e:
+            print(f"Reading files on threads, extraction processes are not available: {str(e)}")
+    return ThreadPoolExecutor(max_workers=DEFAULT_WORKERS), extract_for_organize
+
+#captions an extracted image and plans its move.
+def caption_extracted_image(result: dict, hf_headers, journal: OrganizeJournal):
+    try:
+        folder_name = caption_topic(result['thumbnail'], result['image_hash'], hf_headers)
+        if result['key']:
+            TOPIC_CACHE.put(result['key'], folder_name)
+        journal.plan(result['file'], 'images', folder_name)
+    except Exception as e:
+        print(f"Error processing image {os.path.basename(result['file'])}: {str(e)}")
+
+#organize as a two stage pipeline. files the topic cache doesn't know are read by the extraction pool, and the compact
+#results (excerpts, column names, thumbnails) go through a bounded queue to the api stage. that stage is an event loop:
+#it batches documents and hands every groq or hugging face call to one of workers api threads, so the network stays busy
+#while the next files are being read. every answer is planned in the journal, the moves happen afterwards (journal.apply).
+async def run_organize_pipeline(files, groq_client: Groq, hf_headers, workers: int, batch_size: int, journal: OrganizeJournal,
+                                similar: NearDuplicateIndex, extract_workers: int):
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=max(1, workers) * PIPELINE_QUEUE_PER_WORKER)
+    reading = asyncio.Semaphore(max(1, extract_workers) * 2)
+    api_slots = asyncio.Semaphore(max(1, workers))
+    calls = set()
+    extract_pool, extract = start_extract_pool(extract_workers)
+    api_pool = ThreadPoolExecutor(max_workers=max(1, workers))
+
+    async def read_file(file_path: str):
+        kind = file_kind(file_path)
+        try:
+            if kind is None:
+                journal.plan(file_path, 'other_files', None)
+                return
+            key, topic = await loop.run_in_executor(None, lookup_topic, file_path, kind)
+            if topic is not None:
+                journal.plan(file_path, kind_category(kind), topic)
+                return
+            result = await loop.run_in_executor(extract_pool, extract, file_path, kind, similar is not None)
+            for span in result.pop('spans', ()):
+                TRACER.record(*span)
+            result['key'] = key
+            await queue.put(result)
+        except Exception as e:
+            print(f"Error processing {file_label(file_path)} {os.path.basename(file_path)}: {str(e)}")
+        finally:
+            reading.release()
+
+    async def produce():
+        reads = set()
+        for file_path in files:
+            check_cancelled()
+            await reading.acquire()
+            task = loop.create_task(read_file(file_path))
+            reads.add(task)
+            task.add_done_callback(reads.discard)
+        if reads:
+            await asyncio.wait(reads)
+        await queue.put(None)
+
+    def call_finished(future):
+        api_slots.release()
+        calls.discard(future)
+        if not future.cancelled() and future.exception() is not None:
+            print(f"Error organizing: {str(future.exception())}")
+
+    #waits for a free api worker, so a slow api holds back the queue (and the extraction behind it) instead of piling up calls.
+    async def call_api(function, *args):
+        await api_slots.acquire()
+        future = loop.run_in_executor(api_pool, function, *args)
+        calls.add(future)
+        future.add_done_callback(call_finished)
+
+    async def dispatch():
+        batch = []
+        while True:
+            result = await queue.get()
+            if result is None:
+                break
+            file_path, kind = result['file'], result['kind']
+            if 'error' in result:
+                print(f"Error processing {file_label(file_path)} {os.path.basename(file_path)}: {result['error']}")
+            elif kind == 'image':
+                await call_api(caption_extracted_image, result, hf_headers, journal)
+            elif result['excerpt'] is None:
+                if result['key']:
+                    TOPIC_CACHE.put(result['key'], "Untitled_CSV")
+                journal.plan(file_path, kind_category(kind), "Untitled_CSV")
+            elif similar is None or not similar.add(file_path, kind, result['excerpt'], result.get('signature')):
+                batch.append((file_path, kind, result['key'], result['excerpt']))
+                if len(batch) >= batch_size:
+                    await call_api(process_batch, batch, groq_client, journal)
+                    batch = []
+        if batch:
+            await call_api(process_batch, batch, groq_client, journal)
+        if calls:
+            await asyncio.wait(list(calls))
+
+    try:
+        await asyncio.gather(produce(), dispatch())
+    finally:
+        extract_pool.shutdown(wait=True, cancel_futures=True)
+        api_pool.shutdown(wait=True)
+
+#how long a new file has to stay unchanged before --watch treats it as finished writing.
+WATCH_SETTLE_SECONDS = 2.0
+#how often the folder is rescanned when inotify isn't available (windows, mac).
+WATCH_POLL_SECONDS = 2.0
+#partial downloads and office lock files are never organized, the finished file shows up under its real name.
+WATCH_IGNORED_SUFFIXES = ('.part', '.crdownload', '.download', '.tmp')
+
+#inotify event flags, see inotify(7).
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+
+#minimal inotify watcher on top of libc (linux only), it blocks in select so an idle watch uses no cpu.
+class InotifyWatcher:
+    def __init__(self, folder_path: str):
+        import ctypes
+        import ctypes.util
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if self.libc.inotify_add_watch(self.fd, os.fsencode(folder_path), mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {folder_path}")
+
+    #waits up to timeout seconds (forever when None) and returns the names of the files that changed.
+    #None is returned when the kernel queue overflowed and the folder has to be rescanned.
+    def read(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        names = []
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = struct.unpack_from('iIII', data, offset)
+            name = data[offset + 16:offset + 16 + length].rstrip(b'\0')
+            offset += 16 + length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if name and not mask & IN_ISDIR:
+                names.append(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+#names of the files sitting directly in a folder.
+def list_folder_files(folder_path: str):
+    with os.scandir(folder_path) as entries:
+        return [entry.name for entry in entries if entry.is_file()]
+
+#yields files as they appear in a folder, once they've stopped changing for WATCH_SETTLE_SECONDS.
+#uses inotify when it's available and falls back to polling the folder every WATCH_POLL_SECONDS.
+def watch_for_files(folder_path: str, watcher=None):
+    candidates = {}
+    handled = set()
+    while True:
+        if watcher is not None:
+            names = watcher.read(WATCH_SETTLE_SECONDS if candidates else None)
+            if names is None:
+                names = list_folder_files(folder_path)
+        else:
+            time.sleep(WATCH_POLL_SECONDS)
+            present = set(list_folder_files(folder_path))
+            handled &= present
+            names = present - handled
+
+        for name in names:
+            if name.startswith(('.', '~$')) or name.lower().endswith(WATCH_IGNORED_SUFFIXES):
+                continue
+            candidates.setdefault(os.path.join(folder_path, name), None)
+
+        now = time.monotonic()
+        for file_path in list(candidates):
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                del candidates[file_path]
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            previous = candidates[file_path]
+            if previous is None or previous[0] != signature:
+                candidates[file_path] = (signature, now)
+            elif now - previous[1] >= WATCH_SETTLE_SECONDS:
+                del candidates[file_path]
+                handled.add(os.path.basename(file_path))
+                yield file_path
+
+#organize --watch: organizes what's already in the folder, then keeps organizing new files as they're dropped in.
+def watch_folder(folder_path: str, groq_client: Groq, hf_headers, workers: int = DEFAULT_WORKERS, batch_size: int = BATCH_SIZE):
+    if not os.path.exists(folder_path):
+        print(f"Folder not found: {folder_path}")
+        return
+
+    try:
+        watcher = InotifyWatcher(folder_path)
+    except (OSError, AttributeError, TypeError):
+        watcher = None
+
+    try:
+        organize_folder(folder_path, groq_client, hf_headers, workers=workers, batch_size=batch_size)
+        print(f"Watching {folder_path} for new files, press Ctrl+C to stop...")
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for file_path in watch_for_files(folder_path, watcher):
+                future = executor.submit(organize_file, file_path, folder_path, groq_client, hf_headers)
+                future.add_done_callback(lambda future, name=os.path.basename(file_path): report_failure(future, name))
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+    finally:
+        if watcher is not None:
+            watcher.close()
+
+#prints the error of a failed background organize task.
+def report_failure(future, name: str):
+    if future.exception() is not None:
+        print(f"Error organizing {name}: {str(future.exception())}")
+
+#sends a single file to the right processor based on its extension.
+def organize_file(file_path: str, folder_path: str, groq_client: Groq, hf_headers):
+    file_extension = os.path.splitext(file_path)[1].lower()
+
+    if file_extension in ('.png', '.jpg', '.jpeg', '.gif'):
+        process_image(file_path, folder_path, hf_headers)
+    elif file_extension == '.pdf':
+        process_pdf(file_path, folder_path, groq_client)
+    elif file_extension in ('.xls', '.xlsx'):
+        process_excel(file_path, folder_path, groq_client)
+    elif file_extension == '.csv':
+        process_csv(file_path, folder_path, groq_client)
+    elif file_extension in ('.doc', '.docx'):
+        process_doc_docx(file_path, folder_path, groq_client)
+    else:
+        move_to_other_files(file_path, folder_path)
+
+#document kinds that can be classified in batches, with their category folder and the name used in error messages.
+DOCUMENT_KINDS = {'.pdf': 'pdf', '.xls': 'excel', '.xlsx': 'excel', '.csv': 'csv', '.doc': 'doc', '.docx': 'doc'}
+DOCUMENT_CATEGORIES = {
+    'pdf': ('pdfs', 'PDF'),
+    'excel': ('excels', 'Excel'),
+    'csv': ('csvs', 'CSV'),
+    'doc': ('docs', 'document')
+}
+EXCERPT_EXTRACTORS = {
+    'pdf': extract_pdf_text,
+    'excel': extract_excel_columns,
+    'csv': extract_csv_columns,
+    'doc': extract_doc_text
+}
+
+#trains the local classifier from a folder fastfox already organized (or any folder laid out as pdfs/<topic>/<file>...).
+#every topic folder becomes one centroid: the normalized mean of its documents' tf-idf vectors.
+def train_local_model(folder_path: str, workers: int = DEFAULT_WORKERS):
+    import numpy as np
+
+    if not os.path.exists(folder_path):
+        print(f"Folder not found: {folder_path}")
+        return
+
+    samples = []
+    for category, kind in TRAINING_CATEGORIES.items():
+        category_folder = os.path.join(folder_path, category)
+        if not os.path.isdir(category_folder):
+            continue
+        for topic in os.listdir(category_folder):
+            topic_folder = os.path.join(category_folder, topic)
+            if os.path.isdir(topic_folder):
+                samples.extend(
+                    (kind, topic, os.path.join(topic_folder, filename)) for filename in os.listdir(topic_folder)
+                    if DOCUMENT_KINDS.get(os.path.splitext(filename)[1].lower()) == kind
+                )
+    if not samples:
+        print(f"No organized documents found in {folder_path}, expected folders like pdfs/<topic>/.")
+        return
+
+    print(f"Reading {len(samples)} documents...")
+
+    def read_sample(kind, topic, file_path):
+        check_cancelled()
+        try:
+            excerpt = EXCERPT_EXTRACTORS[kind](file_path)
+        except Exception as e:
+            print(f"Skipping {os.path.basename(file_path)}: {str(e)}")
+            return None
+        features, frequencies = hash_features(excerpt or "")
+        return (kind, topic, features, frequencies) if len(features) else None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        vectors = [vector for vector in executor.map(lambda sample: read_sample(*sample), samples) if vector]
+    if not vectors:
+        print("None of the documents had readable text.")
+        return
+
+    document_frequency = np.zeros(LOCAL_MODEL_FEATURES, dtype=np.float32)
+    for _, _, features, _ in vectors:
+        document_frequency[features] += 1
+    idf = (np.log((1 + len(vectors)) / (1 + document_frequency)) + 1).astype(np.float32)
+
+    arrays = {'idf': idf}
+    for kind in TRAINING_CATEGORIES.values():
+        topics = sorted({topic for vector_kind, topic, _, _ in vectors if vector_kind == kind})
+        if not topics:
+            continue
+        index = {topic: i for i, topic in enumerate(topics)}
+        centroids = np.zeros((len(topics), LOCAL_MODEL_FEATURES), dtype=np.float32)
+        for vector_kind, topic, features, frequencies in vectors:
+            if vector_kind == kind:
+                weights = frequencies * idf[features]
+                centroids[index[topic], features] += weights / np.linalg.norm(weights)
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-9)
+        arrays[f'labels_{kind}'] = np.array(topics)
+        arrays[f'centroids_{kind}'] = centroids
+        print(f"{DOCUMENT_CATEGORIES[kind][0]}: {len(topics)} topics")
+
+    os.makedirs(os.path.dirname(LOCAL_MODEL_FILE), exist_ok=True)
+    temporary_file = LOCAL_MODEL_FILE + ".tmp.npz"
+    np.savez_compressed(temporary_file, **arrays)
+    os.replace(temporary_file, LOCAL_MODEL_FILE)
+    print(f"Local model trained on {len(vectors)} documents and saved to {LOCAL_MODEL_FILE}")
+
+#name of a file's type in error messages.
+def file_label(file_path: str) -> str:
+    kind = DOCUMENT_KINDS.get(os.path.splitext(file_path)[1].lower())
+    return DOCUMENT_CATEGORIES[kind][1] if kind else "image"
+
+#classifies a batch of extracted documents, given as (file path, kind, cache key, excerpt), and plans their moves.
+#files the batch answer missed are classified one by one.
+def process_batch(batch, groq_client: Groq, journal: OrganizeJournal):
+    topics = CLASSIFIER.classify_many([(str(i), kind, excerpt) for i, (_, kind, _, excerpt) in enumerate(batch, 1)], groq_client)
+
+    for i, (file_path, kind, key, excerpt) in enumerate(batch, 1):
+        category, label = DOCUMENT_CATEGORIES[kind]
+        try:
+            topic = topics.get(str(i)) or classify_document(kind, excerpt, groq_client)
+            if key:
+                TOPIC_CACHE.put(key, topic)
+            journal.plan(file_path, category, topic)
+        except Exception as e:
+            print(f"Error processing {label} {os.path.basename(file_path)}: {str(e)}")
+
+MOVE_LOCK = threading.Lock()
+#target folders move_file has already made, so sorting thousands of files into a few folders doesn't call makedirs for each.
+CREATED_FOLDERS = set()
+
+#moves a file into the target folder and returns the new path.
+#the lock makes sure two workers never pick the same name, an existing file gets a _1, _2... suffix instead of being overwritten.
+@traced('move')
+def move_file(file_path: str, target_folder: str) -> str:
+    name, extension = os.path.splitext(os.path.basename(file_path))
+    with MOVE_LOCK:
+        if target_folder not in CREATED_FOLDERS:
+            os.makedirs(target_folder, exist_ok=True)
+            CREATED_FOLDERS.add(target_folder)
+        new_file_path = os.path.join(target_folder, name + extension)
+        counter = 1
+        while os.path.exists(new_file_path):
+            new_file_path = os.path.join(target_folder, f"{name}_{counter}{extension}")
+            counter += 1
+        try:
+            os.rename(file_path, new_file_path)
+        except FileNotFoundError:
+            #the folder was removed since it was made (a long running server outlives folders), make it again
+            if os.path.isdir(target_folder):
+                raise
+            os.makedirs(target_folder, exist_ok=True)
+            os.rename(file_path, new_file_path)
+    return new_file_path
+
+#images are shrunk to fit in this many pixels before captioning, BLIP itself works on 384px inputs.
+CAPTION_IMAGE_SIZE = 512
+#photos whose perceptual hashes differ in at most this many of the 64 bits are treated as the same picture.
+IMAGE_HASH_DISTANCE = 6
+
+#computes the 64 bit difference hash of an image, near-identical photos (resized, recompressed, re-saved) get close hashes.
+def image_dhash(image) -> int:
+    from PIL import Image
+
+    pixels = list(image.convert('L').resize((9, 8), Image.LANCZOS).getdata())
+    image_hash = 0
+    for row in range(8):
+        for column in range(8):
+            left = pixels[row * 9 + column]
+            right = pixels[row * 9 + column + 1]
+            image_hash = (image_hash << 1) | (left > right)
+    return image_hash
+
+#makes a small jpeg thumbnail of an image for the captioner and returns it with the image's perceptual hash.
+#jpegs are decoded straight at reduced scale, so big camera photos never get fully decoded.
+@traced('image.thumbnail')
+def prepare_image(image_path: str):
+    from PIL import Image
+
+    with Image.open(image_path) as image:
+        image.draft('RGB', (CAPTION_IMAGE_SIZE, CAPTION_IMAGE_SIZE))
+        image = image.convert('RGB')
+    image.thumbnail((CAPTION_IMAGE_SIZE, CAPTION_IMAGE_SIZE))
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', quality=85)
+    return buffer.getvalue(), image_dhash(image)
+
+#gets the folder name of an image from its BLIP caption.
+def get_image_topic(image_path: str, hf_headers) -> str:
+    return caption_topic(*prepare_image(image_path), hf_headers)
+
+#gets the folder name for an image thumbnail made by prepare_image.
+#a photo that looks like one captioned before reuses that folder, otherwise only the thumbnail is uploaded.
+def caption_topic(thumbnail: bytes, image_hash: int, hf_headers) -> str:
+    if TOPIC_CACHE.enabled:
+        folder_name = TOPIC_CACHE.find_similar_image(image_hash, IMAGE_HASH_DISTANCE)
+        if folder_name is not None:
+            return folder_name
+
+    response = query_huggingface_api(None, CAPTION_MODEL, hf_headers, data=thumbnail)
+    
+    if isinstance(response, list) and len(response) > 0 and 'generated_text' in response[0]:
+        folder_name = simplify_caption(response[0]['generated_text'])
+        if TOPIC_CACHE.enabled:
+            TOPIC_CACHE.put_image_hash(image_hash, folder_name)
+        return folder_name
+    raise ValueError(f"Unable to generate caption. Response: {response}")
+
+#processes a doc/docx file.
+def process_doc_docx(file_path: str, base_folder: str, groq_client: Groq):
+    try:
+        topic = cached_topic(file_path, 'doc', CLASSIFIER.model, lambda: get_doc_topic(file_path, groq_client))
+        move_file(file_path, os.path.join(base_folder, 'docs', topic))
+        print(f"Moved {os.path.basename(file_path)} to docs/{topic} folder")
+    except Exception as e:
+        print(f"Error processing document {os.path.basename(file_path)}: {str(e)}")
+
+#processes a csv file.
+def process_csv(file_path: str, base_folder: str, groq_client: Groq):
+    try:
+        topic = cached_topic(file_path, 'csv', CLASSIFIER.model, lambda: get_csv_topic(file_path, groq_client))
+        move_file(file_path, os.path.join(base_folder, 'csvs', topic))
         print(f"Moved {os.path.basename(file_path)} to csvs/{topic} folder")
     except Exception as e:
         print(f"Error processing CSV {os.path.basename(file_path)}: {str(e)}")
 
+#processes an image file.
 def process_image(file_path: str, base_folder: str, hf_headers):
     try:
-        with open(file_path, "rb") as image_file:
-            image_data = image_file.read()
-        
-        payload = {
-            "inputs": {
-                "image": base64.b64encode(image_data).decode('utf-8')
-            }
-        }
-        
-        response = query_huggingface_api(payload, "Salesforce/blip-image-captioning-large", hf_headers)
-        
-        if isinstance(response, list) and len(response) > 0 and 'generated_text' in response[0]:
-            caption = response[0]['generated_text']
-            folder_name = simplify_caption(caption)
-            category_folder = os.path.join(base_folder, 'images', folder_name)
-            os.makedirs(category_folder, exist_ok=True)
-            new_file_path = os.path.join(category_folder, os.path.basename(file_path))
-            os.rename(file_path, new_file_path)
-            print(f"Moved {os.path.basename(file_path)} to images/{folder_name} folder")
-        else:
-            print(f"Error: Unable to generate caption for {os.path.basename(file_path)}. Response: {response}")
+        folder_name = cached_topic(file_path, 'image', CAPTION_MODEL, lambda: get_image_topic(file_path, hf_headers))
+        move_file(file_path, os.path.join(base_folder, 'images', folder_name))
+        print(f"Moved {os.path.basename(file_path)} to images/{folder_name} folder")
     except Exception as e:
         print(f"Error processing {os.path.basename(file_path)}: {str(e)}")
 
 #processes a pdf file.
 def process_pdf(file_path: str, base_folder: str, groq_client: Groq):
     try:
-        topic = get_pdf_topic(file_path, groq_client)
-        category_folder = os.path.join(base_folder, 'pdfs', topic)
-        os.makedirs(category_folder, exist_ok=True)
-        new_file_path = os.path.join(category_folder, os.path.basename(file_path))
-        os.rename(file_path, new_file_path)
+        topic = cached_topic(file_path, 'pdf', CLASSIFIER.model, lambda: get_pdf_topic(file_path, groq_client))
+        move_file(file_path, os.path.join(base_folder, 'pdfs', topic))
         print(f"Moved {os.path.basename(file_path)} to pdfs/{topic} folder")
     except Exception as e:
         print(f"Error processing PDF {os.path.basename(file_path)}: {str(e)}")
@@ -472,20 +2730,15 @@ def process_pdf(file_path: str, base_folder: str, groq_client: Groq):
 #processes an excel file
 def process_excel(file_path: str, base_folder: str, groq_client: Groq):
     try:
-        topic = get_excel_topic(file_path, groq_client)
-        category_folder = os.path.join(base_folder, 'excels', topic)
-        os.makedirs(category_folder, exist_ok=True)
-        new_file_path = os.path.join(category_folder, os.path.basename(file_path))
-        os.rename(file_path, new_file_path)
+        topic = cached_topic(file_path, 'excel', CLASSIFIER.model, lambda: get_excel_topic(file_path, groq_client))
+        move_file(file_path, os.path.join(base_folder, 'excels', topic))
         print(f"Moved {os.path.basename(file_path)} to excels/{topic} folder")
     except Exception as e:
         print(f"Error processing Excel {os.path.basename(file_path)}: {str(e)}")
 
 #moves any other file type to the other_files folder (like json, mp4, etc.)
 def move_to_other_files(file_path: str, base_folder: str):
-    other_files_folder = os.path.join(base_folder, 'other_files')
-    new_file_path = os.path.join(other_files_folder, os.path.basename(file_path))
-    os.rename(file_path, new_file_path)
+    move_file(file_path, os.path.join(base_folder, 'other_files'))
     print(f"Moved {os.path.basename(file_path)} to other_files folder")
 
 #extracts the code from the response generated by the mistral model
@@ -495,6 +2748,167 @@ def extract_code_from_response(response: str) -> str:
         return code_blocks[0].strip()
     return response.strip()
 
+#codeit suggest sends at most this many lines of the file, taken from the parts that match the request best.
+CODEIT_CONTEXT_LINES = 300
+#the symbol index splits definitions longer than this, so one huge function can't use up the whole budget.
+CODEIT_REGION_LINES = 80
+#lines that start a definition in the usual languages, the name is in the first group that matched.
+DEFINITION_PATTERN = re.compile(
+    r'^\s*(?:export\s+)?(?:default\s+)?(?:async\s+)?(?:def|class|function|fn|func|struct|interface|impl|enum|trait)\s+([A-Za-z_$][\w$]*)'
+    r'|^\s*(?:export\s+)?(?:const|let|var)\s+([A-Za-z_$][\w$]*)\s*=\s*(?:async\s*)?(?:function|\()'
+)
+HUNK_HEADER = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+\d+(?:,(\d+))? @@')
+
+#lowercase words of a request or identifier, snake_case and camelCase names are split into their parts too.
+def code_terms(text: str) -> set:
+    return set(code_term_list(text))
+
+#code_terms with repeats, for term counts.
+def code_term_list(text: str) -> list:
+    terms = []
+    for identifier in re.findall(r'[A-Za-z_][A-Za-z0-9_]*', text):
+        identifier_term = identifier.lower()
+        terms.append(identifier_term)
+        for part in re.findall(r'[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+', identifier):
+            if part.lower() != identifier_term:
+                terms.append(part.lower())
+    return [term for term in terms if len(term) > 2]
+
+#cheap symbol index of a file: (start, end, name) line ranges, one per definition, split into CODEIT_REGION_LINES pieces.
+def index_regions(lines) -> list:
+    starts = [(0, None)]
+    for i, line in enumerate(lines):
+        match = DEFINITION_PATTERN.match(line)
+        if match:
+            if i == 0:
+                starts[0] = (0, match.group(1) or match.group(2))
+            else:
+                starts.append((i, match.group(1) or match.group(2)))
+
+    regions = []
+    for (start, name), (end, _) in zip(starts, starts[1:] + [(len(lines), None)]):
+        for piece in range(start, end, CODEIT_REGION_LINES):
+            regions.append((piece, min(end, piece + CODEIT_REGION_LINES), name))
+    return regions
+
+#picks the parts of the file to send with a suggest request: the whole file when it's small, otherwise the code before
+#the first definition plus the regions whose names, words or line numbers match the request, within CODEIT_CONTEXT_LINES.
+def select_regions(lines, request: str) -> list:
+    if len(lines) <= CODEIT_CONTEXT_LINES:
+        return [(0, len(lines))]
+
+    regions = index_regions(lines)
+    request_terms = code_terms(request)
+    line_numbers = {int(number) for number in re.findall(r'\blines?\s+(\d+)', request, re.IGNORECASE)}
+
+    def score(region):
+        start, end, name = region
+        value = len(request_terms & code_terms("\n".join(lines[start:end])))
+        if name:
+            value += 3 * len(request_terms & code_terms(name))
+            value += 10 if name.lower() in request_terms else 0
+        value += 100 if any(start < number <= end for number in line_numbers) else 0
+        return value
+
+    scores = {region: score(region) for region in regions}
+    ranked = sorted(regions, key=scores.get, reverse=True)
+    if scores[ranked[0]] > 0:
+        ranked = [region for region in ranked if scores[region] > 0]
+
+    header_end = min(next((start for start, _, name in regions if name), len(lines)), 30)
+    selected = [(0, header_end)] if header_end else []
+    budget = CODEIT_CONTEXT_LINES - header_end
+    for start, end, _ in ranked:
+        if end - start <= budget and (start, end) not in selected:
+            selected.append((start, end))
+            budget -= end - start
+
+    merged = []
+    for start, end in sorted(selected):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    return merged
+
+#reads the hunks of a unified diff as (old start line, old lines, new lines), text around the diff is ignored.
+#models often drop the leading space of empty context lines, so an empty line inside a hunk counts as context.
+def parse_unified_diff(text: str) -> list:
+    hunks = []
+    hunk = None
+    old_left = new_left = 0
+    for line in text.split('\n'):
+        header = HUNK_HEADER.match(line)
+        if header:
+            hunk = (int(header.group(1)), [], [])
+            hunks.append(hunk)
+            old_left = int(header.group(2) or 1)
+            new_left = int(header.group(3) or 1)
+        elif hunk is None:
+            continue
+        #lines inside the counts are body lines, even --- and +++ ones (removed sql, lua and haskell comments, c
+        #decrements...). the hunk ends once the header's line counts are used up, whatever comes next.
+        elif line.startswith('+'):
+            hunk[2].append(line[1:])
+            new_left -= 1
+        elif line.startswith('-'):
+            hunk[1].append(line[1:])
+            old_left -= 1
+        elif line.startswith(' ') or line == '':
+            hunk[1].append(line[1:])
+            hunk[2].append(line[1:])
+            old_left -= 1
+            new_left -= 1
+        elif not line.startswith('\\'):
+            hunk = None
+        if hunk is not None and old_left <= 0 and new_left <= 0:
+            hunk = None
+
+    for _, old, new in hunks:
+        while old and new and old[-1] == '' and new[-1] == '':
+            old.pop()
+            new.pop()
+    return [hunk for hunk in hunks if hunk[1] != hunk[2]]
+
+#finds where the old lines of a hunk are in the file, the match closest to the line the diff named wins.
+#trailing whitespace is ignored since models rarely copy it exactly.
+def find_hunk(lines, old, expected: int):
+    if not old:
+        return max(0, min(expected, len(lines)))
+    wanted = [line.rstrip() for line in old]
+    first = wanted[0]
+    candidates = [
+        i for i in range(len(lines) - len(old) + 1)
+        if lines[i].rstrip() == first and [line.rstrip() for line in lines[i:i + len(old)]] == wanted
+    ]
+    return min(candidates, key=lambda i: abs(i - expected)) if candidates else None
+
+#applies diff hunks to the lines of a file, returns the new lines and the line numbers of the hunks that applied and failed.
+def apply_hunks(lines, hunks):
+    result = list(lines)
+    offset = 0
+    applied, failed = [], []
+    for old_start, old, new in hunks:
+        #a hunk without old lines (-N,0) inserts after line N, the others start at line N
+        position = find_hunk(result, old, (old_start if not old else old_start - 1) + offset)
+        if position is None:
+            failed.append(old_start)
+            continue
+        result[position:position + len(old)] = new
+        offset += len(new) - len(old)
+        applied.append(position + 1)
+    return result, applied, failed
+
+#the "based on previous conversations" part of a codeit prompt, the past requests and answers that matter for this one.
+def history_prompt(user_request: str, file_path: str) -> str:
+    context = get_relevant_context('code', user_request, file_path)
+    if not context:
+        return ""
+    return "Based on previous conversations:\n" + "\n".join([
+        f"- {item['query']}: {item['response']}"
+        for item in context
+    ])
+
 #code function that takes a file path and a groq client and generates code based on the user's request
 #I'm using the mistral model for this, but you can use any other model of your choice.
 #For me, mistral is the best model for this task because it can generate code that is both concise and readable manner and it's also very fast.
@@ -510,27 +2924,35 @@ def code(file_path: str, groq_client: Groq):
         content = file.read()
 
     user_input = input("What would you like to do with the code? (suggest/generate): ")
-
-    context = get_context('code', file_path)
-    context_prompt = ""
-    if context:
-        context_prompt = "Based on previous conversations:\n" + "\n".join([
-            f"- {item['query']}: {item['response']}"
-            for item in context
-        ])
+    history_path = os.path.normcase(os.path.abspath(file_path))
 
     if user_input.lower() == 'suggest':
         user_request = input("What changes would you like to suggest? ")
-        prompt = f"{context_prompt}\n\nGiven the following code:\n\n{content}\n\nSuggest changes to fix this code based on this request: {user_request}"
+        context_prompt = history_prompt(user_request, history_path)
+        lines = content.split('\n')
+        regions = select_regions(lines, user_request)
+        file_name = os.path.basename(file_path)
+        excerpt = "\n\n".join(
+            f"Lines {start + 1}-{end}:\n```\n" + "\n".join(lines[start:end]) + "\n```"
+            for start, end in regions
+        )
+        prompt = (f"{context_prompt}\n\nHere are the parts of {file_name} ({len(lines)} lines) that matter for this request:\n\n{excerpt}\n\n"
+                  f"Suggest changes to fix this code based on this request: {user_request}\n\n"
+                  f"Answer with a unified diff against {file_name}: '--- a/{file_name}' and '+++ b/{file_name}' headers, "
+                  f"then @@ -start,count +start,count @@ hunks that use the line numbers above and keep 3 unchanged lines "
+                  f"of context around every change. Only include the lines that change, copied exactly.")
     elif user_input.lower() == 'generate':
         user_request = input("What code would you like to generate? ")
+        context_prompt = history_prompt(user_request, history_path)
         prompt = f"{context_prompt}\n\nGenerate code for the following request: {user_request}"
     else:
         print("Invalid option. Please choose 'suggest' or 'generate'.")
         return
 
     try:
-        chat_completion = groq_client.chat.completions.create(
+        response = groq_stream(
+            groq_client,
+            on_text=print_stream,
             messages=[
                 {
                     "role": "system",
@@ -544,40 +2966,23 @@ def code(file_path: str, groq_client: Groq):
             model="mixtral-8x7b-32768",
             max_tokens=4000
         )
-
-        response = chat_completion.choices[0].message.content.strip()
-        add_to_history('code', user_request, response)
+        print()
+        add_to_history('code', user_request, response, history_path)
 
         if user_input.lower() == 'suggest':
-            suggestions = response.split('\n')
-            lines = content.split('\n')
-            new_content = []
-            changes_made = set()
-
-            for suggestion in suggestions:
-                match = re.match(r'Line (\d+):', suggestion)
-                if match:
-                    line_num = int(match.group(1))
-                    if 1 <= line_num <= len(lines):
-                        new_content.append(f"# Suggestion: {suggestion}")
-                        new_content.append(lines[line_num - 1])
-                        changes_made.add(line_num)
-                    else:
-                        new_content.append(f"# {suggestion}")
-                else:
-                    new_content.append(f"# {suggestion}")
+            hunks = parse_unified_diff(response)
+            if not hunks:
+                print("No diff found in the answer, the file was left unchanged.")
+                return
 
-            for i, line in enumerate(lines, 1):
-                if i not in changes_made:
-                    new_content.append(line)
-
-            with open(file_path, 'w') as file:
-                file.write('\n'.join(new_content))
-
-            if changes_made:
-                print(f"Changes suggested in lines: {', '.join(map(str, sorted(changes_made)))}")
-            else:
-                print("Please check the file for general suggestions.")
+            new_lines, applied, failed = apply_hunks(lines, hunks)
+            if applied:
+                with open(file_path, 'w') as file:
+                    file.write('\n'.join(new_lines))
+                print(f"Applied {len(applied)} of {len(hunks)} changes, at lines: {', '.join(map(str, applied))}")
+            if failed:
+                print(f"Couldn't apply the changes the diff placed at lines {', '.join(map(str, failed))}, "
+                      f"their original lines weren't found in {file_path}.")
 
         elif user_input.lower() == 'generate':
             generated_code = extract_code_from_response(response)
@@ -588,45 +2993,337 @@ def code(file_path: str, groq_client: Groq):
     except Exception as e:
         print(f"An error occurred: {str(e)}")
 
+#splits the command line into positional arguments and options, options are written as --flag or --name=value.
+def parse_args(args):
+    positional = []
+    options = {}
+    for arg in args:
+        if arg.startswith('--'):
+            name, _, value = arg[2:].partition('=')
+            options[name.lower()] = value if value else True
+        else:
+            positional.append(arg)
+    return positional, options
+
+#globs of --include and --exclude, several can be given separated by commas (--include=*.pdf,*.docx).
+def split_globs(value) -> tuple:
+    if not value or value is True:
+        return ()
+    return tuple(pattern.strip() for pattern in str(value).split(',') if pattern.strip())
+
+#resident server: `fastfox serve` keeps the api clients, imported modules, nltk tagger, caches and history open,
+#and every other fastfox call hands its arguments to it over a unix domain socket instead of starting from scratch.
+SERVER_SOCKET = os.path.join(os.path.expanduser("~"), ".fastfox", "fastfox.sock")
+#the client whose request the server is running, None outside the server.
+CURRENT_CLIENT = PerThread()
+#calls that change module settings (the classifier, the topic cache) and share their client, tracer and stats with their
+#worker threads. the server runs them one at a time, other calls run right away, next to them.
+EXCLUSIVE_COMMANDS = ('organize', 'train')
+ORGANIZE_LOCK = threading.Lock()
+
+#stops a forwarded call whose client went away, the way Ctrl+C stops it when fastfox runs on its own. long runs call it
+#between files so the server doesn't keep classifying and moving files for nobody.
+def check_cancelled():
+    client = CURRENT_CLIENT.get()
+    if client is not None and client.closed:
+        raise EOFError("the client disconnected")
+
+#server side of one client connection, messages are json lines:
+#  client -> server  {"argv": [...], "cwd": ...}, then {"input": line} and {"returncode": n} answers
+#  server -> client  {"out": text}, {"err": text}, {"read": true}, {"run": command} and finally {"exit": code}
+class ClientSession:
+    def __init__(self, connection):
+        self.connection = connection
+        self.file = connection.makefile('rwb')
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def send(self, message: dict):
+        with self.lock:
+            if self.closed:
+                return
+            try:
+                self.file.write(json.dumps(message).encode('utf-8') + b"\n")
+                self.file.flush()
+            except OSError:
+                self.closed = True
+
+    def receive(self) -> dict:
+        line = self.file.readline() if not self.closed else b""
+        if not line:
+            self.closed = True
+            raise EOFError("the client disconnected")
+        return json.loads(line)
+
+    def write(self, text: str, stream: str = 'out'):
+        self.send({stream: text})
+
+    def readline(self) -> str:
+        self.send({'read': True})
+        return self.receive().get('input', '')
+
+    def run(self, command: str) -> int:
+        self.send({'run': command})
+        return self.receive().get('returncode', 1)
+
+    #notices when the client goes away (Ctrl+C, a closed terminal) while its call runs, even when the call prints nothing
+    #for a while. the socket is only peeked at, answers to prompts stay there for receive.
+    def watch(self):
+        import socket
+
+        def wait_for_disconnect():
+            while not self.closed:
+                try:
+                    readable, _, _ = select.select([self.connection], [], [], 0.5)
+                    if readable and not self.connection.recv(1, socket.MSG_PEEK):
+                        self.closed = True
+                    elif readable:
+                        time.sleep(0.1)
+                except (OSError, ValueError):
+                    self.closed = True
+        threading.Thread(target=wait_for_disconnect, daemon=True).start()
+
+    def close(self, code: int):
+        self.send({'exit': code})
+        self.closed = True
+        self.file.close()
+        self.connection.close()
+
+#stands in for sys.stdout, sys.stderr and sys.stdin in the server, so print() and input() talk to the current client.
+#it has no fileno(), that makes input() use write and readline instead of the server's own terminal.
+class ServerStream:
+    def __init__(self, original, name: str):
+        self.original = original
+        self.name = name
+        self.encoding = getattr(original, 'encoding', 'utf-8')
+
+    def write(self, text: str) -> int:
+        client = CURRENT_CLIENT.get()
+        if client is None:
+            return self.original.write(text)
+        client.write(text, self.name)
+        return len(text)
+
+    def flush(self):
+        if CURRENT_CLIENT.get() is None:
+            self.original.flush()
+
+    def readline(self, size: int = -1) -> str:
+        client = CURRENT_CLIENT.get()
+        if client is None:
+            return self.original.readline(size)
+        return client.readline()
+
+    def isatty(self) -> bool:
+        return False
+
+#runs one forwarded fastfox call in the server. its paths are taken from the folder the client was called from, the
+#server's own working folder never changes since calls run at the same time.
+def handle_client(connection):
+    session = ClientSession(connection)
+    try:
+        request = session.receive()
+    except (EOFError, ValueError):
+        connection.close()
+        return
+
+    session.watch()
+    argv = request['argv']
+    exclusive = bool(argv) and argv[0].lower() in EXCLUSIVE_COMMANDS
+    code = 0
+    with ORGANIZE_LOCK if exclusive else nullcontext():
+        CURRENT_CLIENT.set(session, shared=exclusive)
+        try:
+            run_command(argv, request['cwd'])
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else 1
+        except EOFError:
+            code = 1
+        except Exception as e:
+            print(f"An error occurred: {str(e)}")
+            code = 1
+        finally:
+            CURRENT_CLIENT.set(None, shared=exclusive)
+    session.close(code)
+
+#warms everything up once and then serves fastfox calls until Ctrl+C.
+def serve(socket_path: str = SERVER_SOCKET):
+    import signal
+    import socket
+
+    if not hasattr(socket, 'AF_UNIX'):
+        print("Server mode needs unix domain sockets, which this Python doesn't support.")
+        return
+    if os.path.exists(socket_path):
+        if forward_to_server(None, socket_path) is not None:
+            print(f"A FastFox server is already running on {socket_path}.")
+            return
+        os.remove(socket_path)
+
+    print("Warming up...")
+    initialize()
+    preload_modules('organize')
+    HISTORY.connect()
+    TOPIC_CACHE.connect()
+    COMMAND_CACHE.connect()
+    try:
+        ensure_nltk_data()
+        get_tagger()
+    except Exception as e:
+        print(f"Couldn't load the NLTK tagger, it will be loaded on first use: {str(e)}")
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    os.chmod(socket_path, 0o600)
+    server.listen(16)
+    sys.stdout = ServerStream(sys.stdout, 'out')
+    sys.stderr = ServerStream(sys.stderr, 'err')
+    sys.stdin = ServerStream(sys.stdin, 'in')
+    print(f"FastFox server ready on {socket_path}, press Ctrl+C to stop it.")
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while True:
+            connection, _ = server.accept()
+            threading.Thread(target=handle_client, args=(connection,), daemon=True).start()
+    except KeyboardInterrupt:
+        print("Stopping the FastFox server.")
+    finally:
+        server.close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+#sends a fastfox call to the running server and relays its output, prompts and commands until it's done.
+#returns the exit code, or None when no server is running. argv None only checks that the server answers.
+def forward_to_server(argv, socket_path: str = SERVER_SOCKET):
+    import socket
+
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(socket_path):
+        return None
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except OSError:
+        client.close()
+        return None
+    if argv is None:
+        client.close()
+        return 0
+
+    with client, client.makefile('rwb') as stream:
+        def send(message: dict):
+            stream.write(json.dumps(message).encode('utf-8') + b"\n")
+            stream.flush()
+
+        send({'argv': argv, 'cwd': os.getcwd()})
+        for line in stream:
+            message = json.loads(line)
+            if 'out' in message:
+                sys.stdout.write(message['out'])
+                sys.stdout.flush()
+            elif 'err' in message:
+                sys.stderr.write(message['err'])
+                sys.stderr.flush()
+            elif 'read' in message:
+                send({'input': sys.stdin.readline()})
+            elif 'run' in message:
+                send({'returncode': subprocess.run(message['run'], shell=True).returncode})
+            elif 'exit' in message:
+                return message['exit']
+    print("The FastFox server closed the connection.")
+    return 1
+
 #main function that handles the command line arguments and calls the appropriate function based on the command type
+#calls are forwarded to a running `fastfox serve` unless --local is given, watch mode always runs here since it never ends.
 def main():
     #checking if the first run flag exists, if not, it means this is the first time the program is run
     #if it's the first time, it will set up the batch files and the system path
     #you can remove this if statement if you want to run the program instead of the exe
     first_run_flag = os.path.join(os.path.expanduser("~"), ".fastfox", ".first_run")
-    if not os.path.exists(first_run_flag):
+    if os.name == 'nt' and not os.path.exists(first_run_flag):
         setup_batch_files()
         os.makedirs(os.path.dirname(first_run_flag), exist_ok=True)
         with open(first_run_flag, 'w') as f:
             f.write('installed')
 
-    groq_client, hf_headers = initialize()
-    
-    global CONVERSATION_HISTORY
-    CONVERSATION_HISTORY = load_conversation_history()
+    args = sys.argv[1:]
+    _, options = parse_args(args[1:])
+    if args and args[0].lower() != 'serve' and not options.get('local') and not options.get('watch'):
+        code = forward_to_server(args)
+        if code is not None:
+            sys.exit(code)
+
+    setup_env()
+
+    if args and args[0].lower() == 'serve':
+        serve()
+    else:
+        run_command(args)
+
+#runs one fastfox call, args are the command line arguments after the script name. relative paths are taken from cwd
+#when it's given (the client's folder in the server), from the working folder otherwise.
+def run_command(args, cwd: str = None):
+    global CLASSIFIER
     
-    if len(sys.argv) < 2:
-        print("Usage: command <query> or organize <path> or codeit <file> or forget <all|command|codeit|organize>")
+    if len(args) < 1:
+        print("Usage: command <query> [--fresh] [--fuzzy] or organize <path> [--workers=N] [--batch=N] [--watch] [--dry-run] [--undo] [--near-duplicates] [--no-dedup] [--recursive] [--include=<globs>] [--exclude=<globs>] [--extract-workers=N] [--backend=auto|local|remote] or train <organized folder> or codeit <file> or forget <all|cache|command|codeit|organize> or serve")
+        print("Any command also takes --stats (per-stage timings), --trace=<file.jsonl>, --prom=<file.prom> and --local (don't use the server)")
         return
 
-    command_type = sys.argv[1].lower()
-    query = sys.argv[2] if len(sys.argv) > 2 else ""
+    command_type = args[0].lower()
+    positional, options = parse_args(args[1:])
+    query = positional[0] if positional else ""
+    resolve = lambda path: os.path.join(cwd, path) if cwd and path else path
+    if command_type in ("organize", "codeit", "train"):
+        query = resolve(query)
+
+    #organize and train share the tracer and stats with their worker threads, other calls keep theirs to their thread
+    shared = command_type in EXCLUSIVE_COMMANDS
+    TRACER.set(Tracer(), shared)
+    HF_STATS.set(CallStats(), shared)
+    if options.get('trace'):
+        TRACER.open_trace(resolve(str(options['trace'])))
 
     try:
-        if command_type in ["command", "organize", "codeit", "forget"]:
+        if command_type in ["command", "organize", "codeit", "forget", "train"]:
+            if command_type not in ("forget", "train", "command"):
+                groq_client, hf_headers = initialize()
             if command_type == "command":
-                suggest_command(query, groq_client)
+                suggest_command(query, use_cache=not options.get('fresh'), fuzzy=bool(options.get('fuzzy')))
             elif command_type == "organize":
-                organize_folder(query, groq_client, hf_headers)
+                workers = int(options.get('workers', DEFAULT_WORKERS))
+                batch_size = int(options.get('batch', BATCH_SIZE))
+                TOPIC_CACHE.enabled = not options.get('no-cache', False)
+                CLASSIFIER = select_backend(str(options.get('backend', 'auto')).lower(), float(options.get('confidence', LOCAL_CONFIDENCE)))
+                if options.get('undo'):
+                    undo_organize(query)
+                elif options.get('watch'):
+                    watch_folder(query, groq_client, hf_headers, workers=workers, batch_size=batch_size)
+                else:
+                    organize_folder(query, groq_client, hf_headers, workers=workers, batch_size=batch_size, dry_run=bool(options.get('dry-run')),
+                                    dedup=not options.get('no-dedup'), near_duplicates=bool(options.get('near-duplicates')),
+                                    recursive=bool(options.get('recursive')), include=split_globs(options.get('include')),
+                                    exclude=split_globs(options.get('exclude')), extract_workers=int(options.get('extract-workers', EXTRACT_WORKERS)))
             elif command_type == "codeit":
                 code(query, groq_client)
             elif command_type == "forget":
                 forget(query)
+            elif command_type == "train":
+                train_local_model(query)
         else:
-            print("Invalid command type. Use command, organize, code, or forget.")
+            print("Invalid command type. Use command, organize, codeit, train, or forget.")
     except Exception as e:
         print(f"An error occurred: {str(e)}")
+    finally:
+        TRACER.close()
+        if options.get('stats'):
+            print(TRACER.summary())
+        if options.get('prom'):
+            TRACER.write_prometheus(resolve(str(options['prom'])))
 
 if __name__ == "__main__":
+    if getattr(sys, 'frozen', False):
+        #the .exe build has to hand its organize extraction processes over to their worker code
+        import multiprocessing
+        multiprocessing.freeze_support()
     print("Starting FastFox...")
     main()